@@ -0,0 +1,251 @@
+from datetime import date, datetime as dt, timedelta
+
+import numpy as np
+
+from feed import NO_ITEM_ID
+
+INTERVALS = ('day', 'week', 'month')
+
+
+def local_midnights(days, user_tz):
+    """UTC epoch timestamps of midnight in user_tz on each of days."""
+    return np.array([dt(day.year, day.month, day.day, tzinfo=user_tz).timestamp() for day in days])
+
+
+def interval_starts(interval, first, last):
+    """The first day of every interval (a day, a Monday or the 1st of a month) from the one containing first to the one after last."""
+    if interval == 'day':
+        start, step = first, lambda day: day + timedelta(days=1)
+    elif interval == 'week':
+        start, step = first - timedelta(days=first.weekday()), lambda day: day + timedelta(days=7)
+    else:
+        start = first.replace(day=1)
+        step = lambda day: date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    starts = [start]
+    while starts[-1] <= last:
+        starts.append(step(starts[-1]))
+    return starts
+
+
+def rounded(values, digits=2):
+    """Python floats rounded to digits, with NaN and infinity as None so they serialize to JSON."""
+    return [round(value, digits) if np.isfinite(value) else None for value in values.tolist()]
+
+
+class FeedAnalytics:
+    """
+    NumPy views of a FeedSnapshot's columns for grouped and windowed stats.
+    The numeric columns are read straight out of the snapshot's buffer
+    without copying; brand names are coded into integers. For a snapshot
+    appended to the one previous was built from, only the new rows are coded
+    and merged into the brand ordering. Rows are ordered by timestamp, so
+    time ranges are found with searchsorted instead of scanning.
+    """
+
+    def __init__(self, snapshot, previous=None):
+        self.generation = snapshot.generation
+        self.rows = len(snapshot)
+        self.timestamps = np.frombuffer(snapshot.timestamps, dtype=np.float64)
+        self.item_ids = np.frombuffer(snapshot.item_ids, dtype=np.int64)
+        self.prices_before = np.frombuffer(snapshot.prices_before, dtype=np.float64)
+        self.prices_after = np.frombuffer(snapshot.prices_after, dtype=np.float64)
+        self.increases = np.frombuffer(snapshot.increases, dtype=np.float64)
+        self.flags = np.frombuffer(snapshot.flags, dtype=np.uint8)
+
+        start, brands, codes, brand_ids = 0, [], {}, np.empty(0, dtype=np.int32)
+        self._previous_by_brand = None
+        if previous is not None and snapshot.header.get('appended_to') == previous.generation and snapshot.header.get('appended_from') == previous.rows:
+            start, brands, codes, brand_ids = previous.rows, list(previous.brands), dict(previous.brand_codes), previous.brand_ids
+            self._previous_by_brand = previous._by_brand
+
+        def code(brand):
+            brand_id = codes.get(brand)
+            if brand_id is None:
+                brand_id = codes[brand] = len(brands)
+                brands.append(brand)
+            return brand_id
+
+        item_brands = snapshot.item_brands
+        new_ids = np.fromiter((code(item_brands[i]) for i in range(start, self.rows)), dtype=np.int32, count=self.rows - start)
+        self.brand_ids = np.concatenate([brand_ids, new_ids])
+        self.brands = brands
+        self.brand_codes = codes
+        self.brand_lookup = {}
+        for brand, brand_id in codes.items():
+            self.brand_lookup.setdefault(brand.lower(), brand_id)
+        self._by_brand = None
+        self._is_high = None
+
+    def matches(self, snapshot):
+        return self.generation == snapshot.generation and self.rows == len(snapshot)
+
+    def brand_id(self, brand):
+        """The code for a brand name (case-insensitive), or None if the feed has never seen it."""
+        return self.brand_lookup.get(brand.lower())
+
+    @property
+    def by_brand(self):
+        """Row numbers ordered by brand and then increase, sorted the first time they're needed."""
+        if self._by_brand is None:
+            previous = self._previous_by_brand
+            if previous is None or self.rows - len(previous) > len(previous) // 10:
+                self._by_brand = np.lexsort((self.increases, self.brand_ids))
+            else:
+                self._by_brand = self._merged_by_brand(previous)
+            self._previous_by_brand = None
+        return self._by_brand
+
+    def _merged_by_brand(self, previous):
+        """by_brand for these rows from the ordering of the rows they were appended to."""
+        start = len(previous)
+        new_rows = start + np.lexsort((self.increases[start:], self.brand_ids[start:]))
+        brand_ids = self.brand_ids[previous]
+        increases = self.increases[previous]
+        positions = []
+        for row in new_rows.tolist():
+            lo, hi = np.searchsorted(brand_ids, [self.brand_ids[row], self.brand_ids[row] + 1])
+            positions.append(lo + np.searchsorted(increases[lo:hi], self.increases[row], side='right'))
+        return np.insert(previous, positions, new_rows)
+
+    @property
+    def is_high(self):
+        """
+        Whether each row took its item to a new all-time high: a price_after
+        above the item's first price_before and every price_after before it.
+        Worked out over the whole history the first time it's needed.
+        """
+        if self._is_high is None:
+            self._is_high = self._all_time_highs()
+        return self._is_high
+
+    def _all_time_highs(self):
+        if not self.rows:
+            return np.empty(0, dtype=bool)
+        # Rows are already in timestamp order, so a stable sort by item puts
+        # each item's updates together in order (rows without an item id in a
+        # group of their own). Prices are replaced by their ranks and each
+        # item's ranks are offset past the previous item's, so one running
+        # maximum over every row never carries across items.
+        no_item = self.flags & NO_ITEM_ID != 0
+        item_ids = np.where(no_item, -1, self.item_ids)
+        order = np.argsort(item_ids, kind='stable')
+        item_ids = item_ids[order]
+        prices, ranks = np.unique(np.concatenate([self.prices_before[order], self.prices_after[order]]), return_inverse=True)
+        before_ranks, after_ranks = ranks[:self.rows], ranks[self.rows:]
+        starts = np.r_[True, item_ids[1:] != item_ids[:-1]]
+        segments = np.cumsum(starts) - 1
+        offsets = segments.astype(np.int64) * len(prices)
+
+        running = np.maximum.accumulate(offsets + after_ranks)
+        previous = np.r_[-1, running[:-1] - offsets[1:]]
+        previous[starts] = -1
+        previous = np.maximum(previous, before_ranks[np.flatnonzero(starts)][segments])
+
+        is_high = np.empty(self.rows, dtype=bool)
+        is_high[order] = (after_ranks > previous) & ~no_item[order]
+        return is_high
+
+    def highs(self, edges, brand_id=None):
+        """
+        All-time-high events and distinct items that reached one in each
+        [edges[i], edges[i + 1]) range of UTC timestamps, optionally only for
+        one brand.
+        """
+        lo, hi = np.searchsorted(self.timestamps, [edges[0], edges[-1]])
+        mask = self.is_high[lo:hi]
+        if brand_id is not None:
+            mask = mask & (self.brand_ids[lo:hi] == brand_id)
+        buckets = np.searchsorted(edges, self.timestamps[lo:hi][mask], side='right') - 1
+        item_ids = self.item_ids[lo:hi][mask]
+
+        count = len(edges) - 1
+        events = np.bincount(buckets, minlength=count)
+        stride = int(item_ids.max(initial=0)) + 1
+        pairs = np.sort(buckets.astype(np.int64) * stride + item_ids)
+        pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+        items = np.bincount(pairs // stride, minlength=count)
+        return events, items
+
+    def brand_summary(self, since=None):
+        """
+        (brand ids, counts, median and mean increase %) for every brand with
+        updates since the given UTC timestamp. Updates from a price of zero
+        have no meaningful percentage and are left out.
+        """
+        order = self.by_brand
+        increases = self.increases[order]
+        mask = np.isfinite(increases)
+        if since is not None:
+            mask &= self.timestamps[order] >= since
+        increases = increases[mask]
+        brand_ids = self.brand_ids[order][mask]
+        if not len(brand_ids):
+            empty = np.empty(0)
+            return brand_ids, empty.astype(np.int64), empty, empty
+
+        starts = np.flatnonzero(np.r_[True, brand_ids[1:] != brand_ids[:-1]])
+        counts = np.diff(np.r_[starts, len(brand_ids)])
+        medians = (increases[starts + (counts - 1) // 2] + increases[starts + counts // 2]) / 2
+        means = np.add.reduceat(increases, starts) / counts
+        return brand_ids[starts], counts, medians, means
+
+    def rolling(self, edges, window, brand_id=None):
+        """
+        The number of events and their mean increase % over every run of
+        window consecutive days, given the UTC timestamps of consecutive local
+        midnights in edges. The first result is for the window ending at
+        edges[window]. Like brand_summary, the means leave out updates from a
+        price of zero.
+        """
+        lo, hi = np.searchsorted(self.timestamps, [edges[0], edges[-1]])
+        increases = self.increases[lo:hi]
+        selected = np.ones(hi - lo, dtype=bool) if brand_id is None else self.brand_ids[lo:hi] == brand_id
+        finite = selected & np.isfinite(increases)
+        events = np.r_[0, np.cumsum(selected)]
+        finite_events = np.r_[0, np.cumsum(finite)]
+        totals = np.r_[0.0, np.cumsum(np.where(finite, increases, 0.0))]
+
+        positions = np.searchsorted(self.timestamps, edges) - lo
+        ends, starts = positions[window:], positions[:-window]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (totals[ends] - totals[starts]) / (finite_events[ends] - finite_events[starts])
+        return events[ends] - events[starts], means
+
+
+def highs_report(analytics, interval, days, today, user_tz, brand_id=None):
+    """All-time-high events and distinct items per interval over the last days days up to today."""
+    starts = interval_starts(interval, today - timedelta(days=days - 1), today)
+    events, items = analytics.highs(local_midnights(starts, user_tz), brand_id)
+    return [
+        {'start': start.isoformat(), 'events': bucket_events, 'items': bucket_items}
+        for start, bucket_events, bucket_items in zip(starts, events.tolist(), items.tolist())
+    ]
+
+
+def rolling_report(analytics, window, days, today, user_tz, brand_id=None):
+    """Events, events per day and mean increase % over the window days ending on each of the last days days."""
+    first = today - timedelta(days=days + window - 2)
+    edge_days = [first + timedelta(days=i) for i in range(days + window)]
+    events, means = analytics.rolling(local_midnights(edge_days, user_tz), window, brand_id)
+    return [
+        {'date': day.isoformat(), 'events': day_events, 'per_day': round(day_events / window, 2), 'mean_increase': mean}
+        for day, day_events, mean in zip(edge_days[window - 1:], events.tolist(), rounded(means))
+    ]
+
+
+def brands_report(analytics, days, min_count, limit, sort_by, today, user_tz):
+    """
+    The limit brands with at least min_count updates over the last days days
+    (or all time), with the most updates or the highest median increase first.
+    """
+    since = local_midnights([today - timedelta(days=days - 1)], user_tz)[0] if days else None
+    brand_ids, counts, medians, means = analytics.brand_summary(since)
+    keep = counts >= min_count
+    brand_ids, counts, medians, means = brand_ids[keep], counts[keep], medians[keep], means[keep]
+    order = np.lexsort((brand_ids, -medians, -counts) if sort_by == 'count' else (brand_ids, -counts, -medians))[:limit]
+    return [
+        {'brand': analytics.brands[brand_id] or None, 'count': count, 'median_increase': median, 'mean_increase': mean}
+        for brand_id, count, median, mean in zip(
+            brand_ids[order].tolist(), counts[order].tolist(), rounded(medians[order]), rounded(means[order])
+        )
+    ]
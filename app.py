@@ -1,28 +1,62 @@
-from flask import Flask, render_template, request, url_for, redirect, abort
-from pymongo import MongoClient
-from datetime import datetime as dt, timedelta, time
+from flask import Flask, render_template, request, url_for, redirect, abort, before_render_template, template_rendered
+import click
+from pymongo import MongoClient, ReadPreference
+from datetime import datetime as dt, timedelta
 from dotenv import load_dotenv
 import os
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-import threading
-import ipaddress
-import urllib.request
 import logging
-import calendar
+import tempfile
+import json
+from functools import partial
+import threading
+from bisect import bisect_left
+
+from feed import FEED_PROJECTION, FeedCache, decode_cursor, encode_cursor, local_day_range, rows_from_documents, utc_tz
+from items import ItemCache, downsample, format_dates
+from messages import MessageEncoder, parse_fields
+from caching import LRUCache
+from compression import COMPRESSIBLE_MIMETYPES, MIN_SIZE, CompressedBody, compress, compress_stream, negotiate
+from cloudflare import CloudflareAllowlist
+from wrapped import WrappedReports, year_fingerprint
+from indexes import check_query_plans, ensure_indexes
+from metrics import Metrics, MongoCommandTimer, resident_memory
+from profiler import SlowRequestProfiler
+from ratelimit import LoadMonitor, TokenBucketLimiter, client_key
 
 load_dotenv('config.env')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
+metrics = Metrics()
+profiler = None
+if os.getenv('PROFILE_SLOW_REQUESTS_MS'):
+    profiler = SlowRequestProfiler(
+        int(os.getenv('PROFILE_SLOW_REQUESTS_MS')) / 1000,
+        interval=int(os.getenv('PROFILE_INTERVAL_MS', 5)) / 1000,
+        logger=app.logger
+    )
+
 MONGODB_URI = os.getenv('MONGODB_URI')
+MONGODB_OPTIONS = {
+    'appname': 'pricesareup',
+    'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', 10)),
+    'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', 1)),
+    'connectTimeoutMS': int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000)),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 30000)),
+    'event_listeners': [MongoCommandTimer(metrics)],
+}
 client = None
+client_pid = None
+client_lock = threading.Lock()
 db = None
 coles_updates_collection = None
+read_collection = None
 
 CLOUDFLARE_IPS_V4_URL = "https://www.cloudflare.com/ips-v4"
 CLOUDFLARE_IPS_V6_URL = "https://www.cloudflare.com/ips-v6"
-CLOUDFLARE_NETWORKS = []
 
 FALLBACK_CLOUDFLARE_NETWORKS = [
     "173.245.48.0/20", "103.21.244.0/22", "103.22.200.0/22", "103.31.4.0/22",
@@ -34,118 +68,302 @@ FALLBACK_CLOUDFLARE_NETWORKS = [
     "2405:8100::/32", "2a06:98c0::/29", "2c0f:f248::/32"
 ]
 
-def load_cloudflare_ips():
-    """Load Cloudflare IP ranges from their published list, with fallback."""
-    global CLOUDFLARE_NETWORKS
-    networks = []
-    
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-    
-    try:
-        req_v4 = urllib.request.Request(CLOUDFLARE_IPS_V4_URL, headers=headers)
-        with urllib.request.urlopen(req_v4) as response:
-            ipv4_data = response.read().decode('utf-8')
-            networks.extend([ipaddress.ip_network(ip.strip()) for ip in ipv4_data.splitlines()])
-        
-        req_v6 = urllib.request.Request(CLOUDFLARE_IPS_V6_URL, headers=headers)
-        with urllib.request.urlopen(req_v6) as response:
-            ipv6_data = response.read().decode('utf-8')
-            networks.extend([ipaddress.ip_network(ip.strip()) for ip in ipv6_data.splitlines()])
-            
-        CLOUDFLARE_NETWORKS = networks
-        app.logger.info(f"Loaded {len(CLOUDFLARE_NETWORKS)} Cloudflare IP networks dynamically.")
-    except Exception as e:
-        app.logger.warning(f"Failed to load Cloudflare IP ranges dynamically: {e}. Using fallback list.")
-        CLOUDFLARE_NETWORKS = [ipaddress.ip_network(ip) for ip in FALLBACK_CLOUDFLARE_NETWORKS]
-        app.logger.info(f"Loaded {len(CLOUDFLARE_NETWORKS)} Cloudflare IP networks from fallback.")
+cloudflare_allowlist = CloudflareAllowlist(
+    [CLOUDFLARE_IPS_V4_URL, CLOUDFLARE_IPS_V6_URL],
+    FALLBACK_CLOUDFLARE_NETWORKS,
+    cache_path=os.getenv('CLOUDFLARE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'pricesareup-cloudflare.txt')),
+    refresh_seconds=int(os.getenv('CLOUDFLARE_REFRESH_SECONDS', 86400)),
+    logger=app.logger
+)
 
-load_cloudflare_ips()
+# Every render_template call counts towards the render phase.
+before_render_template.connect(lambda sender, **extra: metrics.enter('render'), app, weak=False)
+template_rendered.connect(lambda sender, **extra: metrics.leave('render'), app, weak=False)
+
+@app.before_request
+def start_timing():
+    metrics.start_request()
+    if profiler:
+        profiler.begin()
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Report where the request's time went in a Server-Timing header. Registered
+    before the other after_request hooks so it runs last and includes them;
+    streamed bodies are produced after this and aren't counted.
+    """
+    timing = metrics.finish_request(request.endpoint or 'unmatched', str(response.status_code))
+    if timing is None:
+        return response
+    phases, total = timing
+    response.headers['Server-Timing'] = ', '.join(
+        [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in phases.items()] + [f"total;dur={total * 1000:.2f}"]
+    )
+    if profiler:
+        profiler.end(f"{request.method} {request.full_path.rstrip('?')}", total)
+    return response
 
 @app.before_request
 def limit_to_cloudflare():
     """Reject requests not coming from Cloudflare when in Production."""
     if not os.environ.get('FLY_APP_NAME'):
         return None
-    
+
+    if request.endpoint == 'prometheus_metrics':
+        # Fly scrapes metrics over the private network, so these requests never
+        # pass through its proxy. Anything that did came from the internet.
+        if request.headers.get('Fly-Client-IP'):
+            abort(404)
+        return None
+
     client_ip_str = request.headers.get('Fly-Client-IP')
     
     if not client_ip_str:
         app.logger.warning("Blocked request with missing Fly-Client-IP")
         abort(403)
 
-    try:
-        client_ip = ipaddress.ip_address(client_ip_str)
-        is_cloudflare = any(client_ip in network for network in CLOUDFLARE_NETWORKS)
-        
-        if not is_cloudflare:
-            app.logger.warning(f"Blocked request from non-Cloudflare IP: {client_ip_str}")
-            abort(403)
-            
-    except ValueError:
+    is_cloudflare = cloudflare_allowlist.allows(client_ip_str)
+    if is_cloudflare is None:
         app.logger.warning(f"Invalid IP address in header: {client_ip_str}")
         abort(403)
+    if not is_cloudflare:
+        app.logger.warning(f"Blocked request from non-Cloudflare IP: {client_ip_str}")
+        abort(403)
+
+# Tokens added per second and burst size for each class of route. Static
+# files, robots.txt and the sitemap are cheap and cached, so aren't limited.
+RATE_LIMIT_CLASSES = {
+    'page': (1, 30),
+    'api': (2, 60),
+    'stats': (0.2, 10),
+}
+ROUTE_COST_CLASSES = {
+    'index': 'page',
+    'item': 'page',
+    'wrapped': 'page',
+    'api_messages': 'api',
+    'api_items': 'api',
+    'api_stats': 'stats',
+}
+# While the worker is overloaded every request costs this many tokens, so
+# clients that are already using up their bucket are the first turned away.
+OVERLOAD_COST = 4
+RETRY_AFTER_SHED = 5
+
+rate_limiter = None
+if os.getenv('RATE_LIMITING', 'on') != 'off':
+    rate_limiter = TokenBucketLimiter(RATE_LIMIT_CLASSES, maxsize=int(os.getenv('RATE_LIMIT_CLIENTS', 10000)))
+load_monitor = LoadMonitor(
+    max_in_flight=int(os.getenv('SHED_IN_FLIGHT', 6)),
+    max_latency=int(os.getenv('SHED_LATENCY_MS', 500)) / 1000
+)
+
+def is_low_priority():
+    """Requests the page works without: stats, and the prefetches it makes for cards nobody has clicked yet."""
+    return request.endpoint == 'api_stats' or request.headers.get('Purpose') == 'prefetch'
+
+def too_many_requests(cost_class, retry_after):
+    retry_after = max(int(retry_after + 0.999), 1)
+    if cost_class == 'page':
+        response = app.response_class(render_template('banned.html', remaining=retry_after), status=429, mimetype='text/html')
+    else:
+        response = app.response_class(message_encoder.dumps({'error': 'Too many requests', 'retry_after': retry_after}), status=429, mimetype='application/json')
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def limit_requests():
+    """
+    Rate limit expensive routes per client and, while this worker is
+    overloaded, charge more for every request and turn away low priority
+    ones so the pages people are looking at stay fast.
+    """
+    cost_class = ROUTE_COST_CLASSES.get(request.endpoint)
+    if cost_class is None:
+        return None
+
+    overloaded = load_monitor.overloaded()
+    if rate_limiter:
+        # Cloudflare sets CF-Connecting-IP, and limit_to_cloudflare only lets its requests through in production.
+        client = client_key(request.headers.get('CF-Connecting-IP') or request.remote_addr or '')
+        retry_after = rate_limiter.take(client, cost_class, OVERLOAD_COST if overloaded else 1)
+        if retry_after:
+            return too_many_requests(cost_class, retry_after)
+    if overloaded and is_low_priority():
+        response = app.response_class(message_encoder.dumps({'error': 'Busy, try again shortly'}), status=503, mimetype='application/json')
+        response.headers['Retry-After'] = str(RETRY_AFTER_SHED)
+        return response
+    load_monitor.begin()
+
+@app.teardown_request
+def finish_request(error):
+    load_monitor.end()
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+static_assets = LRUCache(maxsize=32)
+
+def get_static_asset(filename):
+    """CompressedBody for a file in the static folder, reloaded when the file changes."""
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.stat(path).st_mtime_ns
+    entry = static_assets.get(filename)
+    if entry is None or entry[0] != mtime:
+        with open(path, 'rb') as f:
+            entry = (mtime, CompressedBody(f.read()))
+        static_assets.put(filename, entry)
+    return entry[1]
+
+@app.url_defaults
+def version_static_urls(endpoint, values):
+    """Add a content hash to static URLs so they can be cached forever."""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        try:
+            values['v'] = get_static_asset(values['filename']).etag[:12]
+        except OSError:
+            pass
+
+@app.after_request
+def compress_response(response):
+    """Compress HTML, JSON, XML and text responses, and mark versioned static files immutable."""
+    if request.endpoint == 'static':
+        return prepare_static_response(response)
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        with metrics.phase('compress'):
+            response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+def prepare_static_response(response):
+    filename = request.view_args.get('filename', '')
+    if response.status_code not in (200, 304):
+        return response
+    try:
+        asset = get_static_asset(filename)
+    except OSError:
+        return response
+    if request.args.get('v') == asset.etag[:12]:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    if response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    with metrics.phase('compress'):
+        body, etag, encoding = asset.get(negotiate(request.accept_encodings))
+    if encoding:
+        response.direct_passthrough = False
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        return response.make_conditional(request)
+    return response
+
+def get_mongo_client():
+    """
+    The MongoClient for this process. Clients aren't fork-safe, so a worker
+    that inherited one from the gunicorn master makes its own.
+    """
+    global client, client_pid, db, coles_updates_collection, read_collection
+    with client_lock:
+        if client is None or client_pid != os.getpid():
+            client = MongoClient(MONGODB_URI, **MONGODB_OPTIONS)
+            client_pid = os.getpid()
+            db = client['coles']
+            coles_updates_collection = db['coles_updates']
+            read_collection = db.get_collection('coles_updates', read_preference=ReadPreference.SECONDARY_PREFERRED)
+        return client
+
+def warm_up_mongo():
+    """Resolve, connect and authenticate before the first request needs the database."""
+    try:
+        get_mongo_client().admin.command('ping')
+    except Exception as e:
+        app.logger.warning(f"MongoDB warmup failed: {e}")
 
 def get_coles_updates_collection():
-    global client, db, coles_updates_collection
-    if client is None:
-        client = MongoClient(MONGODB_URI)
-        db = client['coles']
-        coles_updates_collection = db['coles_updates']
+    get_mongo_client()
     return coles_updates_collection
 
-utc_tz = ZoneInfo("UTC")
+def get_read_collection():
+    """coles_updates for read-only views, which are fine reading from a secondary."""
+    get_mongo_client()
+    return read_collection
 
-lock = threading.Lock()
+def get_wrapped_reports_collection():
+    get_mongo_client()
+    return db['wrapped_reports']
 
-cached_messages = None
-cache_timestamp = None
+MAX_PER_PAGE = 100
 
-def should_refresh_cache():
-    """
-    Determine if the cache needs to be refreshed based on current time.
-    Cache should be refreshed if:
-    1. Cache is empty
-    2. It's past 20:00 UTC and cache was last updated before 20:00 UTC today
-    """
-    global cache_timestamp
-    
-    if cached_messages is None or cache_timestamp is None:
-        return True
-        
-    current_time = dt.now(utc_tz)
-    update_time = time(20, 0)
-    
-    if current_time.time() >= update_time:
-        cache_day = cache_timestamp.date()
-        if cache_day < current_time.date() or (
-            cache_day == current_time.date() and 
-            cache_timestamp.time() < update_time
-        ):
-            return True
-            
-    elif cache_timestamp < (
-        current_time.replace(
-            hour=20, minute=0, second=0, microsecond=0
-        ) - timedelta(days=1)
-    ):
-        return True
-        
-    return False
+MAX_BATCH_ITEMS = 50
+# Charts never need more points than this; longer histories are downsampled.
+CHART_MAX_POINTS = int(os.getenv('CHART_MAX_POINTS', 200))
+MIN_CHART_POINTS = 3
+app.jinja_env.globals['chart_max_points'] = CHART_MAX_POINTS
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
+def load_item_rows(item_ids):
+    """Rows for each of item_ids by item_id, oldest first, from one query."""
+    rows, _ = rows_from_documents(
+        get_read_collection().find({"item_id": {"$in": item_ids}}, FEED_PROJECTION).sort([("item_id", 1), ("date", 1)])
+    )
+    rows_by_item = {}
+    for row in rows:
+        rows_by_item.setdefault(row.item_id, []).append(row)
+    return rows_by_item
+
+feed_cache = FeedCache(
+    get_read_collection,
+    os.getenv('FEED_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'pricesareup-feed.snapshot')),
+    poll_seconds=int(os.getenv('FEED_POLL_SECONDS', 120)),
+    logger=app.logger
+)
+
+wrapped_reports = WrappedReports(get_read_collection, get_wrapped_reports_collection, logger=app.logger)
+
+item_cache = ItemCache(load_item_rows, maxsize=int(os.getenv('ITEM_CACHE_SIZE', 1024)))
+
+LANDING_SIZE = 9
+landing_cache = LRUCache(maxsize=64)
+message_encoder = MessageEncoder(
+    partial(json.dumps, separators=(',', ':'), ensure_ascii=app.json.ensure_ascii, default=app.json.default),
+    cache_size=int(os.getenv('MESSAGE_FRAGMENT_CACHE_SIZE', 20000))
+)
+response_cache = LRUCache(maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 256)))
+
+def get_user_tz():
     timezone_str = request.cookies.get('timezone')
     if timezone_str:
         try:
             user_tz = ZoneInfo(timezone_str)
             app.logger.debug(f"User timezone: {timezone_str}")
+            return user_tz
         except ZoneInfoNotFoundError:
             app.logger.error(f"Invalid timezone in cookie: {timezone_str}. Defaulting to UTC.")
-            user_tz = utc_tz
     else:
         app.logger.debug("No timezone cookie found. Defaulting to UTC.")
-        user_tz = utc_tz
+    return utc_tz
 
+def get_date_buttons(user_tz):
     today = dt.now(user_tz).replace(hour=0, minute=0, second=0, microsecond=0)
     last_seven_days = [today - timedelta(days=i) for i in range(0, 7)]
     date_buttons = []
@@ -160,144 +378,95 @@ def index():
             'date_str': date.strftime('%d/%m/%Y'),
             'label': label
         })
+    return date_buttons
 
-    global cached_messages, cache_timestamp
-
-    cache_info = {}
-    if should_refresh_cache():
-        with lock:
-            if should_refresh_cache():
-                temp_messages = list(get_coles_updates_collection().find().sort("date", -1))
-                cached_messages = temp_messages
-                cache_timestamp = dt.now(utc_tz)
-                cache_info = {
-                    'status': 'miss',
-                    'timestamp': cache_timestamp.strftime('%Y-%m-%d %H:%M:%S UTC')
-                }
-    else:
-        cache_info = {
-            'status': 'hit',
-            'timestamp': cache_timestamp.strftime('%Y-%m-%d %H:%M:%S UTC')
+def get_landing(snapshot, user_tz):
+    """
+    The landing page feed (newest rows, total and date buttons) for user_tz.
+    Built once per snapshot, timezone and local day and shared between
+    requests, so callers must treat it as read-only.
+    """
+    today = dt.now(user_tz).date()
+    key = (snapshot.generation, len(snapshot), user_tz.key, today)
+    landing = landing_cache.get(key)
+    if landing is None:
+        landing = {
+            'messages': tuple(snapshot.serialize(i, user_tz) for i in snapshot.newest(LANDING_SIZE)),
+            'total_messages': len(snapshot),
+            'date_buttons': tuple(get_date_buttons(user_tz))
         }
+        landing_cache.put(key, landing)
+    return landing
 
-    processed_messages = []
-    for message in cached_messages:
-        if message.get("date"):
-            date_obj = message["date"]
-            if date_obj.tzinfo is None:
-                date_obj = date_obj.replace(tzinfo=utc_tz)
-            else:
-                date_obj = date_obj.astimezone(utc_tz)
-
-            message["date_iso"] = date_obj.isoformat()
-            message["date_formatted_utc"] = date_obj.strftime('%d/%m/%Y %H:%M:%S UTC')
-            local_date_obj = date_obj.astimezone(user_tz)
-            message["date_formatted_local"] = local_date_obj.strftime('%d/%m/%Y %I:%M %p %Z')
-            message["timestamp"] = local_date_obj.timestamp()
-
-            if message.get("price_before", 0) != 0:
-                increase = ((message["price_after"] - message["price_before"]) / message["price_before"] * 100)
-            else:
-                increase = float('inf')
-            message["increase"] = increase
-
-            processed_messages.append(message)
-
-    processed_messages.sort(key=lambda m: m["timestamp"], reverse=True)
-
-    messages = processed_messages[:9]
-    total_messages = len(processed_messages)
-
-    return render_template(
-        'index.html',
-        messages=messages,
-        total_messages=total_messages,
-        date_buttons=date_buttons,
-        cache_info=cache_info
-    )
-
-@app.route('/item/<int:item_id>')
-def item(item_id):
-    item_records = list(get_coles_updates_collection().find({"item_id": item_id}).sort("date", 1))
-
-    if not item_records:
-        abort(404)
-
-    first_record = item_records[0]
-    item_brand = first_record.get('item_brand', 'Unknown Brand')
-    item_name = first_record.get('item_name', 'Unknown Name')
-    image_url = first_record.get('image_url', None)
-
-    timezone_str = request.cookies.get('timezone')
-    user_tz = utc_tz
-    if timezone_str:
-        try:
-            user_tz = ZoneInfo(timezone_str)
-            app.logger.debug(f"User timezone: {timezone_str}")
-        except ZoneInfoNotFoundError:
-            app.logger.error(f"Invalid timezone in cookie: {timezone_str}. Defaulting to UTC.")
-
-    price_points = []
-    if item_records:
-        initial_price = item_records[0].get("price_before", 0)
-        fixed_date = dt(2024, 9, 8, tzinfo=utc_tz).astimezone(user_tz)
-        price_points.append((fixed_date, initial_price))
-
-    for record in item_records:
-        if record.get("date"):
-            date_obj = record["date"].replace(tzinfo=utc_tz).astimezone(user_tz)
-            price_after = record.get("price_after", 0)
-            price_points.append((date_obj, price_after))
-
-    unique_points = list(set(price_points))
-
-    unique_points.sort(key=lambda x: (x[0], x[1]))
-
-    dates = [p[0].strftime('%d/%m/%Y') for p in unique_points]
-    prices = [p[1] for p in unique_points]
-
-    if prices:
-        initial_price_before = item_records[0].get("price_before", 0)
-        total_prices = [initial_price_before] + prices
-
-        lowest_price = min(total_prices)
-        highest_price = max(total_prices)
-
-        percentage_change_extremes = ((highest_price - lowest_price) / lowest_price) * 100 if lowest_price else 0
-
-        total_price_changes = 0
-        previous_price = initial_price_before
-        for current_price in prices:
-            if previous_price != current_price:
-                total_price_changes += 1
-            previous_price = current_price
-    else:
-        lowest_price = highest_price = percentage_change_extremes = total_price_changes = "N/A"
+def cached_response(user_tz, query, build, mimetype):
+    """
+    Serve the body built by build() from the response cache.
+    Bodies are keyed on the snapshot, timezone, local day and the normalized
+    query, and carry a strong ETag so repeat requests can get a 304.
+    Compressed variants are made once per cached body.
+    """
+    with metrics.phase('feed'):
+        snapshot = feed_cache.get()
+    key = (request.endpoint, snapshot.generation, len(snapshot), user_tz.key, dt.now(user_tz).date(), query)
+    entry = response_cache.get(key)
+    if entry is None:
+        entry = CompressedBody(build(snapshot))
+        response_cache.put(key, entry)
+    with metrics.phase('compress'):
+        body, etag, encoding = entry.get(negotiate(request.accept_encodings))
+
+    response = app.response_class(body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Cookie')
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
 
-    latest_record = item_records[-1]
-    latest_price_before = latest_record.get("price_before", "N/A")
-    latest_price_after = latest_record.get("price_after", "N/A")
-    change = latest_price_after - latest_price_before if isinstance(latest_price_before, (int, float)) and isinstance(latest_price_after, (int, float)) else "N/A"
-    percentage_change_latest = ((change) / latest_price_before * 100) if isinstance(change, (int, float)) and latest_price_before != 0 else "N/A"
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    user_tz = get_user_tz()
+
+    def build(snapshot):
+        with metrics.phase('feed'):
+            landing = get_landing(snapshot, user_tz)
+        return render_template(
+            'index.html',
+            messages=landing['messages'],
+            total_messages=landing['total_messages'],
+            date_buttons=landing['date_buttons'],
+            feed_info=feed_cache.info()
+        ).encode()
+
+    return cached_response(user_tz, None, build, 'text/html')
+
+def get_item_data(item_id, history, user_tz, max_points=None):
+    """The rendered item view and its chart series, with at most max_points points."""
+    item_brand = history.item_brand
+    item_name = history.item_name
+    with metrics.phase('feed'):
+        indexes = downsample(history.timestamps, history.prices, max_points) if max_points else None
+        dates = format_dates(history, user_tz, indexes)
+        prices = list(history.prices) if indexes is None else [history.prices[i] for i in indexes]
 
     item_url = f"https://coles.com.au/product/{item_id}"
 
-    item_data = {
+    return {
         'html': render_template(
             'item.html',
             item_brand=item_brand,
             item_name=item_name,
-            image_url=image_url,
+            image_url=history.image_url,
             dates=dates,
             prices=prices,
-            lowest_price=lowest_price,
-            highest_price=highest_price,
-            percentage_change_extremes=percentage_change_extremes,
-            total_price_changes=total_price_changes,
-            latest_price_before=latest_price_before,
-            latest_price_after=latest_price_after,
-            change=change,
-            percentage_change_latest=percentage_change_latest,
+            lowest_price=history.lowest_price,
+            highest_price=history.highest_price,
+            percentage_change_extremes=history.percentage_change_extremes,
+            total_price_changes=history.total_price_changes,
+            latest_price_before=history.latest_price_before,
+            latest_price_after=history.latest_price_after,
+            change=history.change,
+            percentage_change_latest=history.percentage_change_latest,
             item_id=item_id,
             item_url=item_url,
             user_tz=user_tz,
@@ -308,168 +477,196 @@ def item(item_id):
         'title': f"{item_brand} {item_name}"
     }
 
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return item_data
-    
-    messages = []
-    timezone_str = request.cookies.get('timezone')
-    if timezone_str:
-        try:
-            user_tz = ZoneInfo(timezone_str)
-            app.logger.debug(f"User timezone: {timezone_str}")
-        except ZoneInfoNotFoundError:
-            app.logger.error(f"Invalid timezone in cookie: {timezone_str}. Defaulting to UTC.")
-            user_tz = utc_tz
-    else:
-        app.logger.debug("No timezone cookie found. Defaulting to UTC.")
-        user_tz = utc_tz
+def get_max_points(default=None):
+    max_points = request.args.get('max_points', default, type=int)
+    return max(max_points, MIN_CHART_POINTS) if max_points else None
 
-    today = dt.now(user_tz).replace(hour=0, minute=0, second=0, microsecond=0)
-    last_seven_days = [today - timedelta(days=i) for i in range(0, 7)]
-    date_buttons = []
-    for i, date in enumerate(last_seven_days):
-        if i == 0:
-            label = "Today"
-        elif i == 1:
-            label = "Yesterday"
-        else:
-            label = f"{i} Days Ago"
-        date_buttons.append({
-            'date_str': date.strftime('%d/%m/%Y'),
-            'label': label
-        })
+@app.route('/item/<int:item_id>')
+def item(item_id):
+    with metrics.phase('feed'):
+        history = item_cache.get(feed_cache.get(), item_id)
 
-    global cached_messages, cache_timestamp
-    
-    cache_info = {}
-    if should_refresh_cache():
-        with lock:
-            if should_refresh_cache():
-                messages = list(get_coles_updates_collection().find().sort("date", -1))
-                cached_messages = messages
-                cache_timestamp = dt.now(utc_tz)
-                cache_info = {
-                    'status': 'miss',
-                    'timestamp': cache_timestamp.strftime('%Y-%m-%d %H:%M:%S UTC')
-                }
-    else:
-        cache_info = {
-            'status': 'hit',
-            'timestamp': cache_timestamp.strftime('%Y-%m-%d %H:%M:%S UTC')
-        }
-    
-    messages = cached_messages
-    total_messages = len(messages)
-    messages = messages[:9]
-
-    for message in messages:
-        if message.get("date"):
-            date_obj = message["date"]
-            if date_obj.tzinfo is None:
-                date_obj = date_obj.replace(tzinfo=utc_tz)
-            else:
-                date_obj = date_obj.astimezone(utc_tz)
+    if history is None:
+        abort(404)
+
+    user_tz = get_user_tz()
+    item_data = get_item_data(item_id, history, user_tz, get_max_points(CHART_MAX_POINTS))
 
-            message["date_iso"] = date_obj.isoformat()
-            message["date_formatted_utc"] = date_obj.strftime('%d/%m/%Y %H:%M:%S UTC')
-            local_date_obj = date_obj.astimezone(user_tz)
-            message["date_formatted_local"] = local_date_obj.strftime('%d/%m/%Y %I:%M %p %Z')
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return item_data
+
+    with metrics.phase('feed'):
+        landing = get_landing(feed_cache.get(), user_tz)
 
     return render_template(
         'index.html',
-        messages=messages,
-        total_messages=total_messages,
-        date_buttons=date_buttons,
-        cache_info=cache_info,
+        messages=landing['messages'],
+        total_messages=landing['total_messages'],
+        date_buttons=landing['date_buttons'],
+        feed_info=feed_cache.info(),
         initial_item=item_data,
-        title=f"{item_brand} {item_name}"
+        title=item_data['title']
     )
 
+@app.route('/api/items')
+def api_items():
+    """
+    Item views for up to MAX_BATCH_ITEMS comma-separated ids, so the page can
+    prefetch every card it shows in one request. Items missing from the feed
+    snapshot are looked up together with one query.
+    """
+    try:
+        item_ids = sorted({int(item_id) for item_id in request.args.get('ids', '').split(',') if item_id.strip()})
+    except ValueError:
+        abort(400)
+    if not item_ids or len(item_ids) > MAX_BATCH_ITEMS or item_ids[0] < -2**63 or item_ids[-1] >= 2**63:
+        abort(400)
+    max_points = get_max_points()
+    user_tz = get_user_tz()
+
+    def build(snapshot):
+        with metrics.phase('feed'):
+            histories = item_cache.get_many(snapshot, item_ids)
+        return message_encoder.dumps({
+            'items': {
+                str(item_id): get_item_data(item_id, history, user_tz, max_points)
+                for item_id, history in histories.items() if history is not None
+            },
+            'missing': [item_id for item_id, history in histories.items() if history is None]
+        }).encode()
+
+    return cached_response(user_tz, (tuple(item_ids), max_points), build, 'application/json')
+
+STATS = ('highs', 'brands', 'rolling')
+STATS_INTERVALS = ('day', 'week', 'month')
+MAX_STATS_DAYS = 3650
+feed_analytics = None
+feed_analytics_lock = threading.Lock()
+
+def get_feed_analytics(snapshot):
+    """
+    FeedAnalytics for snapshot, rebuilt when the snapshot changes. numpy is
+    only imported once stats are asked for, so workers that never serve them
+    don't pay for it.
+    """
+    global feed_analytics
+    from analytics import FeedAnalytics
+    with feed_analytics_lock:
+        if feed_analytics is None or not feed_analytics.matches(snapshot):
+            feed_analytics = FeedAnalytics(snapshot, previous=feed_analytics)
+        return feed_analytics
+
+def get_bounded_arg(name, default, low, high):
+    return min(max(request.args.get(name, default, type=int), low), high)
+
+@app.route('/api/stats')
+def api_stats():
+    """
+    Aggregate stats over the whole feed, picked with stat=:
+    highs: all-time-high events and distinct items per interval (day, week or month) over the last days days
+    rolling: events and mean increase % over a rolling window of days, for each of the last days days
+    brands: count, median and mean increase % per brand, sorted by median or count
+    highs and rolling can be narrowed to one brand.
+    """
+    stat = request.args.get('stat')
+    if stat not in STATS:
+        abort(400)
+    brand = request.args.get('brand', '').strip() or None
+    if stat == 'highs':
+        interval = request.args.get('interval', 'week')
+        if interval not in STATS_INTERVALS:
+            abort(400)
+        query = (stat, brand, interval, get_bounded_arg('days', 365, 1, MAX_STATS_DAYS))
+    elif stat == 'rolling':
+        query = (stat, brand, get_bounded_arg('window', 30, 1, 365), get_bounded_arg('days', 90, 1, MAX_STATS_DAYS))
+    else:
+        brand = None
+        days = request.args.get('days', type=int)
+        query = (
+            stat, None, min(max(days, 1), MAX_STATS_DAYS) if days else None,
+            get_bounded_arg('min_count', 10, 1, 1000000), get_bounded_arg('limit', 20, 1, 200),
+            'count' if request.args.get('sort') == 'count' else 'median'
+        )
+    user_tz = get_user_tz()
+
+    def build(snapshot):
+        import analytics
+
+        with metrics.phase('feed'):
+            stats = get_feed_analytics(snapshot)
+        brand_id = None
+        if brand:
+            brand_id = stats.brand_id(brand)
+            if brand_id is None:
+                abort(404)
+
+        today = dt.now(user_tz).date()
+        with metrics.phase('analytics'):
+            if stat == 'highs':
+                result = {'interval': query[2], 'buckets': analytics.highs_report(stats, query[2], query[3], today, user_tz, brand_id)}
+            elif stat == 'rolling':
+                result = {'window': query[2], 'days': analytics.rolling_report(stats, query[2], query[3], today, user_tz, brand_id)}
+            else:
+                result = {'brands': analytics.brands_report(stats, *query[2:], today, user_tz)}
+        return message_encoder.dumps({'stat': stat, 'brand': brand, 'rows': len(snapshot), **result}).encode()
+
+    return cached_response(user_tz, query, build, 'application/json')
+
 @app.route('/api/messages')
 def api_messages():
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 9))
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 9, type=int), 1), MAX_PER_PAGE)
     selected_date = request.args.get('date', None)
     search_term = request.args.get('search', '').lower()
-    sort_by = request.args.get('sort', 'date')
-
-    timezone_str = request.cookies.get('timezone')
-    user_tz = utc_tz
-    if timezone_str:
-        try:
-            user_tz = ZoneInfo(timezone_str)
-        except ZoneInfoNotFoundError:
-            user_tz = utc_tz
-
-    global cached_messages, cache_timestamp
-    if should_refresh_cache():
-        with lock:
-            if should_refresh_cache():
-                temp_messages = list(get_coles_updates_collection().find().sort("date", -1))
-                cached_messages = temp_messages
-                cache_timestamp = dt.now(utc_tz)
-
-    messages = cached_messages
-
-    processed_messages = []
-    for message in messages:
-        if message.get("date"):
-            date_obj = message["date"]
-            if date_obj.tzinfo is None:
-                date_obj = date_obj.replace(tzinfo=utc_tz)
-            else:
-                date_obj = date_obj.astimezone(utc_tz)
-
-            message["date_iso"] = date_obj.isoformat()
-            message["date_formatted_utc"] = date_obj.strftime('%d/%m/%Y %H:%M:%S UTC')
-            local_date_obj = date_obj.astimezone(user_tz)
-            message["date_formatted_local"] = local_date_obj.strftime('%d/%m/%Y %I:%M %p %Z')
-            message["timestamp"] = local_date_obj.timestamp()
-
-            if message.get("price_before", 0) != 0:
-                increase = ((message["price_after"] - message["price_before"]) / message["price_before"] * 100)
-            else:
-                increase = float('inf')
-            message["increase"] = increase
-
-            search_text = f"{message.get('item_brand', '')} {message.get('item_name', '')} {message.get('item_id', '')} {message.get('price_before', '')} {message.get('price_after', '')}".lower()
-
-            processed_messages.append({
-                **message,
-                "search_text": search_text
-            })
-
-    filtered_messages = processed_messages
-    if search_term:
-        filtered_messages = [m for m in filtered_messages if search_term in m["search_text"]]
-    if selected_date:
-        filtered_messages = [m for m in filtered_messages if selected_date in m["date_formatted_local"]]
-
-    if sort_by == 'increase':
-        filtered_messages.sort(key=lambda m: m["increase"], reverse=True)
-    else:
-        filtered_messages.sort(key=lambda m: m["timestamp"], reverse=True)
-
-    total_count = len(filtered_messages)
-    total_pages = (total_count + per_page - 1) // per_page
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_messages = filtered_messages[start:end]
-    
-    serializable_messages = []
-    for msg in paginated_messages:
-        msg_dict = dict(msg)
-        if '_id' in msg_dict:
-            msg_dict['_id'] = str(msg_dict['_id'])
-        serializable_messages.append(msg_dict)
+    sort_by = 'increase' if request.args.get('sort', 'date') == 'increase' else 'date'
+    after = request.args.get('after')
+    fields = parse_fields(request.args.get('fields'))
+    if fields is None:
+        abort(400)
+
+    after_key = None
+    if after:
+        after_key = decode_cursor(after, sort_by)
+        if after_key is None:
+            abort(400)
+
+    user_tz = get_user_tz()
+    query = (page, per_page, selected_date, search_term, sort_by, after, fields)
+
+    def build(snapshot):
+        with metrics.phase('filter'):
+            selection = None
+            if selected_date:
+                day_range = local_day_range(selected_date, user_tz)
+                selection = snapshot.between(*day_range) if day_range else range(0)
+            if search_term:
+                matches = snapshot.search(search_term)
+                if selection is not None:
+                    matches = matches[bisect_left(matches, selection.start):bisect_left(matches, selection.stop)]
+                selection = matches
+
+            total_count = len(snapshot) if selection is None else len(selection)
+            total_pages = (total_count + per_page - 1) // per_page
+            offset = 0 if after_key else (page - 1) * per_page
+
+            page_indexes = snapshot.page(sort_by, selection, offset, per_page + 1, after_key)
+            next_cursor = None
+            if len(page_indexes) > per_page:
+                page_indexes = page_indexes[:per_page]
+                next_cursor = encode_cursor(sort_by, snapshot.sort_key(page_indexes[-1], sort_by))
+
+        envelope = message_encoder.dumps({
+            "total_count": total_count,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": total_pages,
+            "next_cursor": next_cursor
+        })
+        with metrics.phase('encode'):
+            messages = message_encoder.encode(snapshot, page_indexes, fields, user_tz)
+        return f'{{"messages":{messages},{envelope[1:]}'.encode()
 
-    return {
-        "messages": serializable_messages,
-        "total_count": total_count,
-        "page": page,
-        "per_page": per_page,
-        "total_pages": total_pages
-    }
+    return cached_response(user_tz, query, build, 'application/json')
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -496,156 +693,130 @@ def robots_txt():
 def privacy():
     return render_template('privacy.html')
 
+SITE_URL = 'https://pricesareup.com'
+SITEMAP_SHARD_SIZE = 50000
+sitemap_cache = LRUCache(maxsize=2)
+
+def get_sitemap_urls(snapshot):
+    """(loc, lastmod, changefreq, priority) for every page in the sitemap, built once per snapshot."""
+    key = (snapshot.generation, len(snapshot))
+    urls = sitemap_cache.get(key)
+    if urls is None:
+        def lastmod(row):
+            return dt.fromtimestamp(snapshot.timestamps[row], utc_tz).strftime('%Y-%m-%d')
+
+        item_index = snapshot.item_index
+        urls = [
+            (f'{SITE_URL}/', lastmod(len(snapshot) - 1) if len(snapshot) else '2025-11-29', 'daily', '1.0'),
+            (f'{SITE_URL}/privacy', '2025-12-16', 'monthly', '0.5')
+        ]
+        for item_id in sorted(item_index):
+            urls.append((f'{SITE_URL}/item/{item_id}', lastmod(item_index[item_id][-1]), 'weekly', '0.8'))
+        sitemap_cache.put(key, urls)
+    return urls
+
+def generate_sitemap_index(shard_count, urls):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for shard in range(1, shard_count + 1):
+        shard_urls = urls[(shard - 1) * SITEMAP_SHARD_SIZE:shard * SITEMAP_SHARD_SIZE]
+        lastmod = max(url[1] for url in shard_urls)
+        yield f'<sitemap>\n<loc>{SITE_URL}/sitemap-{shard}.xml</loc>\n<lastmod>{lastmod}</lastmod>\n</sitemap>\n'
+    yield '</sitemapindex>'
+
+def generate_urlset(urls):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for loc, lastmod, changefreq, priority in urls:
+        yield f'<url>\n<loc>{loc}</loc>\n<lastmod>{lastmod}</lastmod>\n<changefreq>{changefreq}</changefreq>\n<priority>{priority}</priority>\n</url>\n'
+    yield '</urlset>'
+
 @app.route('/sitemap.xml')
 def sitemap():
-    urls = [{'loc': 'https://pricesareup.com/', 'lastmod': '2025-11-29', 'changefreq': 'daily', 'priority': '1.0'},
-            {'loc': 'https://pricesareup.com/privacy', 'lastmod': '2025-12-16', 'changefreq': 'monthly', 'priority': '0.5'}]
-    item_ids = get_coles_updates_collection().distinct("item_id")
-    for item_id in item_ids:
-        urls.append({
-            'loc': f'https://pricesareup.com/item/{item_id}',
-            'lastmod': '2025-11-29',
-            'changefreq': 'weekly',
-            'priority': '0.8'
-        })
-    sitemap_content = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
-    for url in urls:
-        sitemap_content += f'<url>\n<loc>{url["loc"]}</loc>\n<lastmod>{url["lastmod"]}</lastmod>\n<changefreq>{url["changefreq"]}</changefreq>\n<priority>{url["priority"]}</priority>\n</url>\n'
-    sitemap_content += '</urlset>'
-    return app.response_class(sitemap_content, mimetype='application/xml')
-
-@app.route('/wrapped/2025')
-def wrapped_2025():
-    start_date = dt(2025, 1, 1, tzinfo=utc_tz)
-    end_date = dt(2026, 1, 1, tzinfo=utc_tz)
-    
-    collection = get_coles_updates_collection()
+    with metrics.phase('feed'):
+        urls = get_sitemap_urls(feed_cache.get())
+    shard_count = (len(urls) + SITEMAP_SHARD_SIZE - 1) // SITEMAP_SHARD_SIZE
+    return app.response_class(generate_sitemap_index(shard_count, urls), mimetype='application/xml')
+
+@app.route('/sitemap-<int:shard>.xml')
+def sitemap_shard(shard):
+    with metrics.phase('feed'):
+        urls = get_sitemap_urls(feed_cache.get())
+    shard_urls = urls[(shard - 1) * SITEMAP_SHARD_SIZE:shard * SITEMAP_SHARD_SIZE] if shard >= 1 else []
+    if not shard_urls:
+        abort(404)
+    return app.response_class(generate_urlset(shard_urls), mimetype='application/xml')
 
-    total_increases = collection.count_documents({
-        "date": {"$gte": start_date, "$lt": end_date},
-        "$expr": {"$gt": ["$price_after", "$price_before"]}
-    })
-
-    pipeline_pct = [
-        {"$match": {
-            "date": {"$gte": start_date, "$lt": end_date},
-            "price_before": {"$ne": 0}
-        }},
-        {"$project": {
-            "item_brand": 1,
-            "item_name": 1,
-            "price_before": 1,
-            "price_after": 1,
-            "increase_pct": {
-                "$multiply": [
-                    {"$divide": [{"$subtract": ["$price_after", "$price_before"]}, "$price_before"]},
-                    100
-                ]
-            }
-        }},
-        {"$sort": {"increase_pct": -1}},
-        {"$limit": 5}
-    ]
-    top_pct_increases = list(collection.aggregate(pipeline_pct))
-
-    pipeline_freq = [
-        {"$match": {
-            "date": {"$gte": start_date, "$lt": end_date},
-            "$expr": {"$gt": ["$price_after", "$price_before"]}
-        }},
-        {"$group": {
-            "_id": "$item_id",
-            "item_brand": {"$first": "$item_brand"},
-            "item_name": {"$first": "$item_name"},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"count": -1}},
-        {"$limit": 5}
-    ]
-    repeat_offenders = list(collection.aggregate(pipeline_freq))
-
-    pipeline_brand = [
-        {"$match": {
-            "date": {"$gte": start_date, "$lt": end_date},
-            "$expr": {"$gt": ["$price_after", "$price_before"]}
-        }},
-        {"$group": {
-            "_id": "$item_brand",
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"count": -1}},
-        {"$limit": 5}
-    ]
-    top_brands = list(collection.aggregate(pipeline_brand))
-
-    pipeline_month = [
-        {"$match": {
-            "date": {"$gte": start_date, "$lt": end_date}
-        }},
-        {"$group": {
-            "_id": {"$month": "$date"},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}}
-    ]
-    monthly_data = list(collection.aggregate(pipeline_month))
-    
-    month_map = {item['_id']: item['count'] for item in monthly_data}
-    month_labels = []
-    month_counts = []
-    max_month_count = 0
-    busiest_month_index = 0
-
-    for i in range(1, 13):
-        month_name = calendar.month_name[i]
-        count = month_map.get(i, 0)
-        month_labels.append(month_name)
-        month_counts.append(count)
-        
-        if count > max_month_count:
-            max_month_count = count
-            busiest_month_index = i
-
-    busiest_month_name = calendar.month_name[busiest_month_index] if busiest_month_index > 0 else "N/A"
-
-    # 6. Aggregate Stats (Averages)
-    pipeline_avg = [
-        {"$match": {
-            "date": {"$gte": start_date, "$lt": end_date},
-            "$expr": {"$gt": ["$price_after", "$price_before"]},
-            "price_before": {"$ne": 0}
-        }},
-        {"$project": {
-            "increase_abs": {"$subtract": ["$price_after", "$price_before"]},
-            "increase_pct": {
-                "$multiply": [
-                    {"$divide": [{"$subtract": ["$price_after", "$price_before"]}, "$price_before"]},
-                    100
-                ]
-            }
-        }},
-        {"$group": {
-            "_id": None,
-            "avg_increase_abs": {"$avg": "$increase_abs"},
-            "avg_increase_pct": {"$avg": "$increase_pct"}
-        }}
-    ]
-    avg_stats = list(collection.aggregate(pipeline_avg))
-    avg_increase_abs = avg_stats[0]['avg_increase_abs'] if avg_stats else 0
-    avg_increase_pct = avg_stats[0]['avg_increase_pct'] if avg_stats else 0
+@app.route('/wrapped/<int:year>')
+def wrapped(year):
+    # year_range needs the start of the following year too.
+    if not dt.min.year <= year < dt.max.year:
+        abort(404)
 
-    return render_template(
-        'wrapped_2025.html',
-        total_increases=total_increases,
-        top_pct_increases=top_pct_increases,
-        repeat_offenders=repeat_offenders,
-        top_brands=top_brands,
-        month_labels=month_labels,
-        month_counts=month_counts,
-        busiest_month_name=busiest_month_name,
-        avg_increase_abs=avg_increase_abs,
-        avg_increase_pct=avg_increase_pct
-    )
+    with metrics.phase('feed'):
+        fingerprint = year_fingerprint(feed_cache.get(), year)
+    if fingerprint is None:
+        abort(404)
+
+    with metrics.phase('report'):
+        report = wrapped_reports.get(year, fingerprint)
+
+    return render_template('wrapped.html', year=year, **report)
+
+CACHES = {
+    'response': response_cache,
+    'landing': landing_cache,
+    'item': item_cache.entries,
+    'message_fragment': message_encoder.fragments,
+    'sitemap': sitemap_cache,
+    'static': static_assets,
+    'cloudflare_verdict': cloudflare_allowlist.verdicts,
+}
+if rate_limiter:
+    CACHES['rate_limit'] = rate_limiter.buckets
+
+@metrics.collect
+def collect_app_metrics():
+    for name, cache in CACHES.items():
+        labels = (('cache', name),)
+        lookups = cache.hits + cache.misses
+        yield 'cache_hits_total', 'counter', 'Cache lookups that found an entry.', labels, cache.hits
+        yield 'cache_misses_total', 'counter', 'Cache lookups that missed.', labels, cache.misses
+        yield 'cache_hit_ratio', 'gauge', 'Hits over lookups since this worker started.', labels, cache.hits / lookups if lookups else None
+        yield 'cache_entries', 'gauge', 'Entries currently cached.', labels, len(cache)
+
+    snapshot = feed_cache.snapshot
+    if snapshot is not None:
+        now = dt.now(utc_tz)
+        yield 'feed_snapshot_generation', 'gauge', 'Generation of the feed snapshot being served.', (), snapshot.generation
+        yield 'feed_snapshot_rows', 'gauge', 'Updates in the feed snapshot being served.', (), len(snapshot)
+        yield 'feed_snapshot_age_seconds', 'gauge', 'Seconds since the feed snapshot being served was written.', (), round((now - snapshot.created_at).total_seconds(), 3)
+        yield 'feed_snapshot_build_age_seconds', 'gauge', 'Seconds since the feed was last reloaded in full.', (), round((now - snapshot.built_at).total_seconds(), 3)
+    yield 'requests_in_flight', 'gauge', 'Rate limited requests this worker is serving.', (), load_monitor.in_flight
+    yield 'request_latency_average_seconds', 'gauge', 'Moving average of how long rate limited requests take.', (), round(load_monitor.latency(), 6)
+    yield 'overloaded', 'gauge', '1 while this worker is charging extra and shedding low priority requests.', (), int(load_monitor.overloaded())
+    yield 'process_resident_memory_bytes', 'gauge', 'Resident memory of this worker, including the snapshot pages it has mapped.', (), resident_memory()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics for the worker that serves the scrape, labelled with its pid."""
+    response = app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response.cache_control.no_store = True
+    return response
+
+@app.cli.command('ensure-indexes')
+@click.option('--check-only', is_flag=True, help="Only explain the app's queries, don't create missing indexes.")
+def ensure_indexes_command(check_only):
+    """Create the indexes coles_updates needs and verify every query uses them."""
+    collection = get_coles_updates_collection()
+    if not check_only:
+        for name in ensure_indexes(collection):
+            click.echo(f"Created index {name}")
+
+    problems = check_query_plans(collection)
+    for name, problem in problems:
+        click.echo(f"{name} query plan uses a {problem}", err=True)
+    if problems:
+        raise click.ClickException("Some queries aren't covered by an index.")
+    click.echo("All query plans use indexes.")
 
 if __name__ == '__main__':
     app.run(debug=True)
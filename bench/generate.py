@@ -0,0 +1,107 @@
+"""
+Generate a synthetic coles_updates collection for benchmarks.
+
+Documents look like the scraper's: a few thousand products from a long
+tail of brands, each changing price a handful of times since collection
+started, with _ids minted at the time of the update. For a given --count
+and --seed the output only differs by when "now" is.
+
+    python bench/generate.py --count 100000 --uri mongodb://localhost:27017
+"""
+import argparse
+import random
+from datetime import datetime as dt, timedelta, timezone
+
+from bson import ObjectId
+
+FIRST_RECORDED = dt(2024, 9, 8, tzinfo=timezone.utc)
+BRANDS = [
+    'Coles', 'Arnott\'s', 'Cadbury', 'Kellogg\'s', 'Sanitarium', 'Nestle', 'Smith\'s', 'Bega',
+    'Dairy Farmers', 'Helga\'s', 'Tip Top', 'Heinz', 'Uncle Tobys', 'Pauls', 'Colgate', 'Dettol',
+    'Huggies', 'Lindt', 'Old El Paso', 'San Remo', 'Masterfoods', 'Continental', 'Sorbent', 'Finish',
+]
+PRODUCTS = [
+    'Full Cream Milk 2L', 'Tim Tam Original 200g', 'Dairy Milk Chocolate 180g', 'Corn Flakes 380g',
+    'Weet-Bix 575g', 'Crinkle Cut Chips 170g', 'Wholemeal Bread 700g', 'Tomato Sauce 500mL',
+    'Rolled Oats 1kg', 'Greek Yoghurt 1kg', 'Toothpaste 200g', 'Antibacterial Wipes 110 Pack',
+    'Nappies Size 4 52 Pack', 'Excellence 70% Cocoa 100g', 'Taco Kit 295g', 'Spaghetti 500g',
+    'Mixed Herbs 10g', 'Chicken Noodle Soup 4 Pack', 'Toilet Tissue 12 Pack', 'Dishwasher Tablets 60 Pack',
+]
+
+
+def generate_documents(count, seed=1, now=None):
+    """count coles_updates documents, in the order they would have been inserted."""
+    rng = random.Random(seed)
+    now = now or dt.now(timezone.utc)
+    span = (now - FIRST_RECORDED).total_seconds()
+    item_count = max(count // 8, 1)
+    items = []
+    for i in range(item_count):
+        items.append({
+            'item_id': 1000000 + i * 7,
+            'item_brand': rng.choice(BRANDS),
+            'item_name': rng.choice(PRODUCTS),
+            'price': round(rng.lognormvariate(1.5, 0.7), 2),
+            'image_url': None if rng.random() < 0.02 else f"https://productimages.coles.com.au/productimages/{i % 10}/{1000000 + i * 7}.jpg",
+        })
+
+    # Updates get more frequent over time, like the real feed.
+    offsets = sorted(span * rng.random() ** 0.7 for _ in range(count))
+    for offset in offsets:
+        item = rng.choice(items)
+        date = FIRST_RECORDED + timedelta(seconds=offset)
+        price_before = item['price']
+        price_after = round(price_before * rng.uniform(1.01, 1.25), 2)
+        if rng.random() < 0.01:
+            price_before = 0
+        if rng.random() < 0.3:
+            price_after = round(price_after)
+        item['price'] = price_after
+        yield {
+            '_id': make_object_id(date, rng),
+            'item_id': item['item_id'],
+            'item_brand': item['item_brand'],
+            'item_name': item['item_name'],
+            'price_before': price_before,
+            'price_after': price_after,
+            'image_url': item['image_url'],
+            'date': date.replace(tzinfo=None),
+        }
+
+
+def make_object_id(date, rng):
+    """An ObjectId minted at date, with a random tail like a real one."""
+    return ObjectId(int(date.timestamp()).to_bytes(4, 'big') + rng.randbytes(8))
+
+
+def insert_documents(collection, count, seed=1, batch_size=10000):
+    batch = []
+    for document in generate_documents(count, seed):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--database', default='coles')
+    parser.add_argument('--drop', action='store_true', help="drop coles_updates and wrapped_reports first")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+    db = MongoClient(args.uri)[args.database]
+    if args.drop:
+        db['coles_updates'].drop()
+        db['wrapped_reports'].drop()
+    insert_documents(db['coles_updates'], args.count, args.seed)
+    print(f"Inserted {args.count} documents into {args.database}.coles_updates")
+
+
+if __name__ == '__main__':
+    main()
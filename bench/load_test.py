@@ -0,0 +1,158 @@
+"""
+Load test the app under different gunicorn worker classes.
+
+Starts gunicorn once per worker class against the MONGODB_URI in the
+environment (e.g. a local mongod), waits for the feed to load, then
+requests a mix of item pages, the feed API and the index from a pool of
+client threads and reports throughput and latency for each run:
+
+    MONGODB_URI=mongodb://localhost:27017 python bench/load_test.py --workers sync gthread
+
+With --mock the app runs against bench/mock_app.py's in-memory database
+instead, with a fixed delay on every query:
+
+    python bench/load_test.py --mock --mock-latency-ms 20
+
+The app is deployed on gunicorn's default sync workers; this only measures
+the alternatives, it doesn't change what production runs.
+"""
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fetch(url, timeout=30):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - start
+
+
+def wait_until_ready(base_url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, _ = fetch(f"{base_url}/api/messages?per_page=1", timeout=5)
+        if status == 200:
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"{base_url} didn't become ready in {timeout}s")
+
+
+def item_urls(base_url):
+    with urllib.request.urlopen(f"{base_url}/sitemap-1.xml") as response:
+        sitemap = response.read().decode()
+    return [f"{base_url}/item/{item_id}" for item_id in re.findall(r'/item/(\d+)</loc>', sitemap)]
+
+
+def request_mix(base_url, items, count, seed=1):
+    """Mostly full item pages (what crawlers hit), with some feed and index traffic."""
+    rng = random.Random(seed)
+    feed_queries = ['', 'sort=increase', 'search=milk', 'page=3', 'search=coles&sort=increase&page=2']
+    urls = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.7 and items:
+            urls.append(rng.choice(items))
+        elif roll < 0.9:
+            urls.append(f"{base_url}/api/messages?{rng.choice(feed_queries)}")
+        else:
+            urls.append(f"{base_url}/")
+    return urls
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_load(urls, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, urls))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for status, _ in results if status != 200)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'rps': len(results) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def start_server(worker_class, port, args):
+    env = dict(os.environ)
+    env['FEED_SNAPSHOT_PATH'] = os.path.join(tempfile.mkdtemp(), 'feed.snapshot')
+    env['RATE_LIMITING'] = 'off'
+    app = args.app
+    extra = []
+    if args.mock:
+        env['MOCK_LATENCY_MS'] = str(args.mock_latency_ms)
+        env['MOCK_DOCUMENTS'] = str(args.mock_documents)
+        app, extra = 'mock_app:app', ['--pythonpath', os.path.join(ROOT, 'bench')]
+    command = [
+        sys.executable, '-m', 'gunicorn', app, *extra,
+        '--bind', f'127.0.0.1:{port}',
+        '--worker-class', worker_class,
+        '--workers', str(args.processes),
+        # gunicorn quietly turns sync workers into gthread ones when threads > 1.
+        '--threads', str(args.threads if worker_class == 'gthread' else 1),
+        '--log-level', 'warning',
+    ]
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', nargs='+', default=['sync', 'gthread'], help="gunicorn worker classes to compare")
+    parser.add_argument('--app', default='app:app')
+    parser.add_argument('--processes', type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=8, help="threads per gthread worker")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--mock', action='store_true', help="use bench/mock_app.py's in-memory database instead of MONGODB_URI")
+    parser.add_argument('--mock-latency-ms', type=int, default=20, help="delay on every mock query")
+    parser.add_argument('--mock-documents', type=int, default=10000, help="synthetic updates in the mock database")
+    args = parser.parse_args()
+
+    results = {}
+    for worker_class in args.workers:
+        server = start_server(worker_class, args.port, args)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_until_ready(base_url)
+            urls = request_mix(base_url, item_urls(base_url), args.requests)
+            run_load(urls[:min(200, len(urls))], args.concurrency)  # warm up caches
+            results[worker_class] = run_load(urls, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'worker':<10} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for worker_class, result in results.items():
+        print(
+            f"{worker_class:<10} {result['requests']:>8} {result['errors']:>6} {result['rps']:>8.1f} "
+            f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
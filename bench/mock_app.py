@@ -0,0 +1,37 @@
+"""
+The app with an in-memory mongomock database standing in for MongoDB, for
+load testing without a mongod (bench/load_test.py --mock). Every query
+sleeps MOCK_LATENCY_MS first, like a round trip to a real server, so worker
+classes that can wait on the database in parallel still show a difference.
+Each worker process generates its own MOCK_DOCUMENTS synthetic updates.
+
+    python bench/load_test.py --mock --workers sync gthread
+"""
+import functools
+import os
+import time
+
+import mongomock
+
+import app as app_module
+from generate import insert_documents
+
+LATENCY = int(os.getenv('MOCK_LATENCY_MS', 20)) / 1000
+QUERY_METHODS = ('find', 'find_one', 'aggregate', 'count_documents', 'replace_one', 'update_one')
+
+
+def delayed(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        time.sleep(LATENCY)
+        return method(*args, **kwargs)
+    return wrapper
+
+
+client = mongomock.MongoClient()
+insert_documents(client['coles']['coles_updates'], int(os.getenv('MOCK_DOCUMENTS', 10000)))
+for name in QUERY_METHODS:
+    setattr(mongomock.collection.Collection, name, delayed(getattr(mongomock.collection.Collection, name)))
+
+app_module.MongoClient = lambda *_, **__: client
+app = app_module.app
@@ -0,0 +1,234 @@
+"""
+Benchmark the app's routes and feed cache in-process.
+
+Loads a synthetic coles_updates collection (bench/generate.py) into
+mongomock, or uses an existing database with --uri, then:
+
+  * cold start: a fresh feed cache with no snapshot file serving /
+  * warm start: a fresh feed cache starting from the snapshot on disk
+  * full refresh: a complete snapshot rebuild from Mongo
+  * incremental refresh: polling 100 new updates into a new generation
+  * a request mix per route through the Flask test client, reporting
+    throughput, p50/p95/p99 latency and peak RSS
+
+and compares the results against bench/baseline.json:
+
+    python bench/run.py --count 10000
+    python bench/run.py --count 100000 --save-baseline
+    python bench/run.py --count 1000000 --uri mongodb://localhost:27017
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime as dt, timedelta, timezone
+
+from generate import generate_documents, insert_documents, make_object_id
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+TIMEZONES = ['Australia/Sydney', 'Australia/Melbourne', 'Australia/Brisbane', 'Australia/Perth', 'Australia/Adelaide', 'UTC']
+SEARCHES = ['milk', 'tim tam', 'coles', 'chips 170', '2.5', 'dairy milk', 'zzz']
+STATS_QUERIES = [
+    'stat=highs', 'stat=highs&interval=day&days=90&brand=coles', 'stat=highs&interval=month&days=3650',
+    'stat=rolling', 'stat=rolling&window=7&days=365&brand=lindt', 'stat=brands', 'stat=brands&sort=count&days=30',
+]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_app(args, snapshot_dir):
+    """Import the app against the benchmark database."""
+    os.environ['FEED_SNAPSHOT_PATH'] = os.path.join(snapshot_dir, 'feed.snapshot')
+    os.environ['CLOUDFLARE_CACHE_PATH'] = os.path.join(snapshot_dir, 'cloudflare.txt')
+    os.environ['FEED_POLL_SECONDS'] = '3600'
+    os.environ['RATE_LIMITING'] = 'off'
+    os.environ.pop('FLY_APP_NAME', None)
+    if args.uri:
+        os.environ['MONGODB_URI'] = args.uri
+    sys.path.insert(0, ROOT)
+    import app
+
+    if not args.uri:
+        import mongomock
+        client = mongomock.MongoClient()
+        insert_documents(client['coles']['coles_updates'], args.count, args.seed)
+        app.MongoClient = lambda *_, **__: client
+    app.app.config['TESTING'] = False
+    return app
+
+
+def fresh_feed_cache(app, path):
+    """Swap in a new FeedCache (and drop everything cached from the old one)."""
+    from feed import FeedCache
+    app.feed_cache = FeedCache(app.get_read_collection, path, poll_seconds=3600, logger=app.app.logger)
+    app.response_cache.clear()
+    app.landing_cache.clear()
+    return app.feed_cache
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run_scenarios(app, snapshot_dir):
+    client = app.app.test_client()
+    path = os.path.join(snapshot_dir, 'scenario.snapshot')
+    results = {}
+
+    fresh_feed_cache(app, path)
+    results['cold_start'] = timed(lambda: client.get('/'))
+
+    fresh_feed_cache(app, path)
+    results['warm_start'] = timed(lambda: client.get('/'))
+
+    feed_cache = fresh_feed_cache(app, path)
+    feed_cache.get()
+    os.remove(path)
+    results['full_refresh'] = timed(feed_cache.refresh)
+
+    now = dt.now(timezone.utc)
+    rng = random.Random(2)
+    new_documents = []
+    for i, document in enumerate(generate_documents(100, seed=2)):
+        date = now - timedelta(seconds=100 - i)
+        document.update({'_id': make_object_id(date, rng), 'date': date.replace(tzinfo=None)})
+        new_documents.append(document)
+    app.get_coles_updates_collection().insert_many(new_documents)
+    results['incremental_refresh'] = timed(feed_cache.refresh)
+
+    fresh_feed_cache(app, os.environ['FEED_SNAPSHOT_PATH']).get()
+    return results
+
+
+def request_mix(app, rng):
+    """Route name -> a function returning the next (path, headers) for it."""
+    snapshot = app.feed_cache.get()
+    item_ids = sorted(snapshot.item_index)
+    today = dt.now(timezone.utc)
+    year = today.year
+
+    def day():
+        return (today - timedelta(days=rng.randrange(7))).strftime('%d/%m/%Y')
+
+    def messages():
+        query = rng.choice([
+            f"page={rng.randrange(1, 20)}",
+            f"sort=increase&page={rng.randrange(1, 5)}",
+            f"search={rng.choice(SEARCHES)}",
+            f"date={day()}",
+            f"date={day()}&search={rng.choice(SEARCHES)}&sort=increase",
+        ])
+        return f"/api/messages?{query}", {}
+
+    return {
+        'index': lambda: ('/', {}),
+        'api_messages': messages,
+        'item': lambda: (f"/item/{rng.choice(item_ids)}", {}),
+        'item_xhr': lambda: (f"/item/{rng.choice(item_ids)}", {'X-Requested-With': 'XMLHttpRequest'}),
+        'sitemap': lambda: ('/sitemap.xml', {}),
+        'sitemap_shard': lambda: ('/sitemap-1.xml', {}),
+        'wrapped': lambda: (f"/wrapped/{rng.choice([year - 1, year])}", {}),
+        'stats': lambda: (f"/api/stats?{rng.choice(STATS_QUERIES)}", {}),
+    }
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_routes(app, requests_per_route, seed):
+    rng = random.Random(seed)
+    results = {}
+    for route, next_request in request_mix(app, rng).items():
+        latencies = []
+        errors = 0
+        for _ in range(requests_per_route):
+            client = app.app.test_client()
+            client.set_cookie('timezone', rng.choice(TIMEZONES))
+            path, headers = next_request()
+            start = time.perf_counter()
+            response = client.get(path, headers=headers)
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in (200, 404):
+                errors += 1
+        latencies.sort()
+        results[route] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': len(latencies) / sum(latencies),
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    return results
+
+
+def change(current, baseline):
+    """Relative change of a time against its baseline, flagged when it moved more than 5%."""
+    if not baseline:
+        return ''
+    delta = (current - baseline) / baseline * 100
+    return f"{delta:+.0f}%{'' if abs(delta) < 5 else (' faster' if delta < 0 else ' slower')}"
+
+
+def print_report(results, baseline):
+    print(f"\n{'scenario':<22} {'seconds':>9} {'vs baseline':>16}")
+    for name, seconds in results['scenarios'].items():
+        print(f"{name:<22} {seconds:>9.3f} {change(seconds, baseline.get('scenarios', {}).get(name)):>16}")
+
+    print(f"\n{'route':<15} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7} {'errors':>6} {'p95 vs baseline':>16}")
+    for route, result in results['routes'].items():
+        base = baseline.get('routes', {}).get(route, {})
+        print(
+            f"{route:<15} {result['rps']:>8.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+            f"{result['p99_ms']:>8.2f} {result['peak_rss_mb']:>7.0f} {result['errors']:>6} "
+            f"{change(result['p95_ms'], base.get('p95_ms')):>16}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=10000, help="documents to generate into mongomock")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--uri', help="benchmark against this database instead of mongomock")
+    parser.add_argument('--requests', type=int, default=200, help="requests per route")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline for --count")
+    args = parser.parse_args()
+
+    snapshot_dir = tempfile.mkdtemp()
+    app = load_app(args, snapshot_dir)
+    results = {
+        'count': args.count,
+        'scenarios': run_scenarios(app, snapshot_dir),
+        'routes': run_routes(app, args.requests, args.seed),
+    }
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    key = args.uri and f"{args.count}-mongod" or str(args.count)
+    print_report(results, baselines.get(key, {}))
+
+    if args.save_baseline:
+        baselines[key] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nSaved baseline for {key} to {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure how long a fresh worker takes to serve its first response.
+
+Times `import app` on its own, then starts gunicorn and polls / until it
+answers 200, first with empty on-disk caches (cold: the feed has to be
+loaded from MONGODB_URI) and then reusing the caches the cold run left
+behind (warm: the feed snapshot and Cloudflare list are read from disk):
+
+    MONGODB_URI=mongodb://localhost:27017 python bench/startup.py
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from load_test import ROOT, fetch
+
+
+def time_import(app_module, env):
+    command = [sys.executable, '-c', f"import time; t = time.perf_counter(); import {app_module}; print(time.perf_counter() - t)"]
+    output = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return float(output.split()[-1])
+
+
+def time_first_response(app, port, env, timeout=120):
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', app, '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=ROOT, env=env
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            status, _ = fetch(f"http://127.0.0.1:{port}/", timeout=timeout)
+            if status == 200:
+                return time.perf_counter() - start
+            time.sleep(0.01)
+        raise RuntimeError(f"No response within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default='app:app')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--runs', type=int, default=3, help="warm starts to average")
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['FEED_SNAPSHOT_PATH'] = os.path.join(cache_dir, 'feed.snapshot')
+    env['CLOUDFLARE_CACHE_PATH'] = os.path.join(cache_dir, 'cloudflare.txt')
+    env['RATE_LIMITING'] = 'off'
+
+    import_seconds = time_import(args.app.split(':')[0], env)
+    cold = time_first_response(args.app, args.port, env)
+    warm = [time_first_response(args.app, args.port, env) for _ in range(args.runs)]
+
+    print(f"import app:            {import_seconds * 1000:8.1f} ms")
+    print(f"first response (cold): {cold * 1000:8.1f} ms")
+    print(f"first response (warm): {sum(warm) / len(warm) * 1000:8.1f} ms (mean of {len(warm)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used cache."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
@@ -0,0 +1,126 @@
+from bisect import bisect_right
+from time import sleep
+import ipaddress
+import logging
+import os
+import threading
+import urllib.request
+
+from caching import LRUCache
+
+
+class NetworkSet:
+    """
+    IP networks compiled into sorted, merged [first, last] integer intervals
+    per address family, so a lookup is a bisect instead of a scan.
+    """
+
+    def __init__(self, networks):
+        intervals = {4: [], 6: []}
+        for network in networks:
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        self.firsts = {}
+        self.lasts = {}
+        for version, ranges in intervals.items():
+            firsts, lasts = [], []
+            for first, last in sorted(ranges):
+                if lasts and first <= lasts[-1] + 1:
+                    lasts[-1] = max(lasts[-1], last)
+                else:
+                    firsts.append(first)
+                    lasts.append(last)
+            self.firsts[version], self.lasts[version] = firsts, lasts
+        self.size = len(networks)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, address):
+        value = int(address)
+        i = bisect_right(self.firsts[address.version], value) - 1
+        return i >= 0 and value <= self.lasts[address.version][i]
+
+
+class CloudflareAllowlist:
+    """
+    Cloudflare's published edge networks, refreshed from a background thread.
+    Starts from the last list saved to cache_path, or the fallback list, so
+    importing the app never waits on the network, and keeps serving the last
+    good list if a refresh fails. Verdicts for recently seen addresses are
+    cached.
+    """
+
+    def __init__(self, urls, fallback, cache_path=None, refresh_seconds=86400, cache_size=4096, logger=None):
+        self.urls = urls
+        self.cache_path = cache_path
+        self.refresh_seconds = refresh_seconds
+        self.logger = logger or logging.getLogger(__name__)
+        self.networks = self._load_cached() or NetworkSet([ipaddress.ip_network(ip) for ip in fallback])
+        self.verdicts = LRUCache(cache_size)
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """Start the refresher thread for this process, fetching the published list straight away."""
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name='cloudflare-refresher', daemon=True)
+        self.thread.start()
+
+    def allows(self, ip_str):
+        """True for Cloudflare addresses, False for others and None if ip_str isn't an IP address."""
+        if self.pid != os.getpid():
+            self.start()
+        networks = self.networks
+        entry = self.verdicts.get(ip_str)
+        if entry is not None and entry[0] is networks:
+            return entry[1]
+        try:
+            verdict = ipaddress.ip_address(ip_str) in networks
+        except ValueError:
+            verdict = None
+        self.verdicts.put(ip_str, (networks, verdict))
+        return verdict
+
+    def refresh(self):
+        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+        networks = []
+        for url in self.urls:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=10) as response:
+                data = response.read().decode('utf-8')
+                networks.extend([ipaddress.ip_network(ip.strip()) for ip in data.splitlines() if ip.strip()])
+        if not networks:
+            raise ValueError("no networks in the published lists")
+        self.networks = NetworkSet(networks)
+        self.logger.info(f"Loaded {len(networks)} Cloudflare IP networks dynamically.")
+        if self.cache_path:
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(''.join(f"{network}\n" for network in networks))
+            os.replace(tmp_path, self.cache_path)
+
+    def _load_cached(self):
+        """Networks saved by the last successful refresh, or None."""
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path) as f:
+                networks = [ipaddress.ip_network(line.strip()) for line in f if line.strip()]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable Cloudflare IP cache {self.cache_path}: {e}")
+            return None
+        if not networks:
+            return None
+        self.logger.info(f"Loaded {len(networks)} Cloudflare IP networks from {self.cache_path}.")
+        return NetworkSet(networks)
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.warning(f"Failed to load Cloudflare IP ranges dynamically: {e}. Keeping {len(self.networks)} known networks.")
+            sleep(self.refresh_seconds)
@@ -0,0 +1,74 @@
+from array import array
+from bisect import bisect_left
+
+
+class StringColumn:
+    """Read-only sequence of strings stored as an offsets array into a UTF-8 heap."""
+
+    __slots__ = ('offsets', 'heap')
+
+    def __init__(self, offsets, heap):
+        self.offsets = offsets
+        self.heap = heap
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.heap[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+
+class ListColumn:
+    """Read-only sequence of arrays stored as an offsets array into one values array."""
+
+    __slots__ = ('offsets', 'values')
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+
+def encode_strings(strings, old=None):
+    """Offsets and heap for a StringColumn of old's strings (if any) followed by strings."""
+    offsets = array('I', old.offsets if old is not None else [0])
+    heap = bytearray(old.heap[:offsets[-1]] if old is not None else b'')
+    for string in strings:
+        heap += string.encode()
+        offsets.append(len(heap))
+    return offsets, heap
+
+
+def merge_lists(old_keys, old_lists, additions):
+    """
+    Offsets and values for a ListColumn with a list for each key in old_keys
+    (ascending) and additions, in key order: the one old_lists has for the
+    key, if any, followed by the additions for it. Lists without additions
+    are copied across in whole runs.
+    """
+    offsets, values = array('I', [0]), array('I')
+    copied = 0
+    for key in sorted(additions):
+        position = bisect_left(old_keys, key)
+        _copy_lists(offsets, values, old_lists, copied, position)
+        if position < len(old_keys) and old_keys[position] == key:
+            values.frombytes(old_lists[position].cast('B'))
+            position += 1
+        values.extend(additions[key])
+        offsets.append(len(values))
+        copied = position
+    _copy_lists(offsets, values, old_lists, copied, len(old_keys))
+    return offsets, values
+
+
+def _copy_lists(offsets, values, old_lists, start, stop):
+    if start == stop:
+        return
+    shift = len(values) - old_lists.offsets[start]
+    values.frombytes(old_lists.values[old_lists.offsets[start]:old_lists.offsets[stop]].cast('B'))
+    offsets.extend(offset + shift for offset in old_lists.offsets[start + 1:stop + 1])
@@ -0,0 +1,75 @@
+import gzip
+import hashlib
+import threading
+import zlib
+
+import brotli
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'application/json', 'application/xml',
+    'application/javascript', 'image/svg+xml', 'image/vnd.microsoft.icon', 'image/x-icon',
+}
+# Bodies smaller than this aren't worth the encoding overhead.
+MIN_SIZE = 512
+
+# Bodies that are compressed once and reused can afford slower, smaller encodings.
+PRECOMPRESSED_LEVELS = {'br': 9, 'gzip': 9}
+ON_THE_FLY_LEVELS = {'br': 4, 'gzip': 6}
+
+
+def negotiate(accept_encodings):
+    """The encoding to use for a request's Accept-Encoding, or None for identity."""
+    for encoding in ('br', 'gzip'):
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(body, encoding, levels=ON_THE_FLY_LEVELS):
+    if encoding == 'br':
+        return brotli.compress(body, quality=levels['br'])
+    return gzip.compress(body, compresslevel=levels['gzip'], mtime=0)
+
+
+def compress_stream(chunks, encoding, levels=ON_THE_FLY_LEVELS):
+    """Compress an iterable of str or bytes chunks as they are produced."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=levels['br'])
+        flush = compressor.finish
+        process = compressor.process
+    else:
+        compressor = zlib.compressobj(levels['gzip'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        flush = compressor.flush
+        process = compressor.compress
+    for chunk in chunks:
+        data = process(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield flush()
+
+
+class CompressedBody:
+    """
+    A response body with a strong ETag, plus a compressed variant per
+    encoding that is made the first time a client asks for it.
+    """
+
+    __slots__ = ('body', 'etag', 'variants', 'lock')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {}
+        self.lock = threading.Lock()
+
+    def get(self, encoding):
+        """(body, etag, encoding) to send to a client that negotiated encoding."""
+        if encoding is None or len(self.body) < MIN_SIZE:
+            return self.body, self.etag, None
+        variant = self.variants.get(encoding)
+        if variant is None:
+            with self.lock:
+                variant = self.variants.get(encoding)
+                if variant is None:
+                    variant = self.variants[encoding] = compress(self.body, encoding, PRECOMPRESSED_LEVELS)
+        return variant, f"{self.etag}-{encoding}", encoding
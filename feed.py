@@ -0,0 +1,745 @@
+from collections import namedtuple
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+import fcntl
+import heapq
+import logging
+import mmap
+import os
+from collections.abc import Mapping
+import threading
+from time import sleep
+from datetime import datetime as dt, time, timedelta
+from zoneinfo import ZoneInfo
+
+from bson import ObjectId, json_util
+
+from columns import ListColumn, StringColumn, merge_lists
+from search import SearchIndex, SearchIndexBuilder
+
+utc_tz = ZoneInfo("UTC")
+utc_epoch = dt(1970, 1, 1, tzinfo=utc_tz)
+naive_utc_epoch = dt(1970, 1, 1)
+
+FeedRow = namedtuple('FeedRow', [
+    'id', 'item_id', 'item_brand', 'item_name', 'price_before', 'price_after',
+    'image_url', 'date', 'date_iso', 'date_formatted_utc', 'timestamp',
+    'increase', 'search_text'
+])
+
+# What the loader keeps per document: only the stored columns, with
+# (timestamp, id) first so records sort in feed order.
+FeedRecord = namedtuple('FeedRecord', [
+    'timestamp', 'id', 'item_id', 'item_brand', 'item_name', 'price_before',
+    'price_after', 'image_url', 'increase'
+])
+
+# The fields of a coles_updates document the feed reads.
+FEED_PROJECTION = {
+    "_id": 1, "item_id": 1, "item_brand": 1, "item_name": 1,
+    "price_before": 1, "price_after": 1, "image_url": 1, "date": 1
+}
+FEED_BATCH_SIZE = 5000
+
+# Snapshot file layout: MAGIC, a 4 byte header length, a JSON header and then
+# every column, each starting on an 8 byte boundary. Numeric columns are raw
+# native-endian arrays; string columns are an offsets array (one entry per row
+# plus one) into a UTF-8 heap. The search and item indexes are stored the same
+# way after the row columns.
+MAGIC = b'PAUFEED2'
+NUMERIC_COLUMNS = {
+    'timestamp': ('timestamps', 'd'),
+    'increase': ('increases', 'd'),
+    'price_before': ('prices_before', 'd'),
+    'price_after': ('prices_after', 'd'),
+    'item_id': ('item_ids', 'q'),
+    'flags': ('flags', 'B'),
+}
+STRING_COLUMNS = {
+    'id': 'ids',
+    'item_brand': 'item_brands',
+    'item_name': 'item_names',
+    'image_url': 'image_urls',
+}
+
+PRICE_BEFORE_INT = 1
+PRICE_AFTER_INT = 2
+NO_IMAGE = 4
+NO_ITEM_ID = 8
+
+
+def calculate_increase(price_before, price_after):
+    """Percentage increase between two prices, infinite when starting from zero."""
+    if price_before != 0:
+        return (price_after - price_before) / price_before * 100
+    return float('inf')
+
+
+def build_search_text(item_brand, item_name, item_id, price_before, price_after):
+    return f"{item_brand} {item_name} {item_id} {price_before} {price_after}".lower()
+
+
+def make_record(document):
+    """Compact FeedRecord for a coles_updates document."""
+    date_obj = document["date"]
+    if date_obj.tzinfo is None:
+        timestamp = (date_obj - naive_utc_epoch).total_seconds()
+    else:
+        timestamp = (date_obj - utc_epoch).total_seconds()
+
+    price_before = document.get("price_before", 0)
+    price_after = document.get("price_after")
+    return FeedRecord(
+        timestamp,
+        str(document.get("_id", '')),
+        document.get("item_id"),
+        document.get("item_brand", ''),
+        document.get("item_name", ''),
+        price_before,
+        price_after,
+        document.get("image_url"),
+        calculate_increase(price_before, price_after)
+    )
+
+
+def format_local(row, user_tz):
+    return format_local_date(row.date, user_tz)
+
+
+def format_local_date(date_obj, user_tz):
+    return date_obj.astimezone(user_tz).strftime('%d/%m/%Y %I:%M %p %Z')
+
+
+def local_day_range(date_str, user_tz):
+    """
+    Convert a dd/mm/YYYY calendar day in the user's timezone into the
+    [start, end) range of UTC epoch timestamps it covers.
+    Returns None if the date can't be parsed or its range falls outside what
+    datetime can represent (31/12/9999 has no next midnight).
+    """
+    try:
+        day = dt.strptime(date_str, '%d/%m/%Y').date()
+        start = dt(day.year, day.month, day.day, tzinfo=user_tz)
+        end = dt.fromordinal(day.toordinal() + 1).replace(tzinfo=user_tz)
+        return start.timestamp(), end.timestamp()
+    except (ValueError, OverflowError):
+        return None
+
+
+def encode_cursor(sort_by, key):
+    """Opaque token for the sort key of the last row a client has seen."""
+    token = ':'.join([sort_by] + [repr(part) if isinstance(part, float) else part for part in key])
+    return urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_by):
+    """Turn a cursor back into a sort key, or None if it isn't valid for sort_by."""
+    try:
+        parts = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':')
+        if parts[0] != sort_by:
+            return None
+        if sort_by == 'increase':
+            return float(parts[1]), float(parts[2]), parts[3]
+        return float(parts[1]), parts[2]
+    except (ValueError, IndexError):
+        return None
+
+
+def max_id(current, candidate):
+    if candidate is None:
+        return current
+    if current is None or candidate > current:
+        return candidate
+    return current
+
+
+def poll_from(last_id, overlap=timedelta(seconds=60)):
+    """
+    Lower bound for polling new documents. ObjectIds made by different
+    clients within the same second aren't ordered, so ObjectId polls look a
+    little further back and rely on the caller to skip rows it already has.
+    """
+    if isinstance(last_id, ObjectId):
+        return ObjectId.from_datetime(last_id.generation_time - overlap)
+    return last_id
+
+
+def rows_from_documents(documents):
+    """FeedRecords for every dated document, sorted oldest first, and the largest _id seen."""
+    rows = []
+    last_id = None
+    for document in documents:
+        last_id = max_id(last_id, document.get("_id"))
+        if document.get("date"):
+            rows.append(make_record(document))
+    # FeedRecords start with (timestamp, id), which is unique, so they sort by it.
+    rows.sort()
+    return rows, last_id
+
+
+class RecordStream:
+    """
+    FeedRecords in feed order from documents sorted by date, as they are read.
+    Documents that share a date are put in _id order here, so only one date's
+    worth is held at a time. last_id is the largest _id read so far.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.last_id = None
+
+    def __iter__(self):
+        group = []
+        for document in self.documents:
+            self.last_id = max_id(self.last_id, document.get("_id"))
+            if not document.get("date"):
+                continue
+            record = make_record(document)
+            if group and record.timestamp != group[0].timestamp:
+                group.sort()
+                yield from group
+                group = []
+            group.append(record)
+        group.sort()
+        yield from group
+
+
+def encode_rows(rows, previous=None):
+    """
+    Column arrays for rows, with string offsets starting from zero, and the
+    search and item index columns covering them. When rows come after every
+    row of a previous snapshot, the index columns cover its rows too.
+    """
+    columns = {name: array(typecode) for name, (_, typecode) in NUMERIC_COLUMNS.items()}
+    strings = {name: (array('I', [0]), bytearray()) for name in STRING_COLUMNS}
+    search_index = SearchIndexBuilder(previous.search_index if previous is not None else None)
+    item_index = ItemIndexBuilder(previous.item_index if previous is not None else None)
+    for row_id, row in enumerate(rows, len(previous) if previous is not None else 0):
+        flags = 0
+        if isinstance(row.price_before, int):
+            flags |= PRICE_BEFORE_INT
+        if isinstance(row.price_after, int):
+            flags |= PRICE_AFTER_INT
+        if row.image_url is None:
+            flags |= NO_IMAGE
+        if row.item_id is None:
+            flags |= NO_ITEM_ID
+        columns['timestamp'].append(row.timestamp)
+        columns['increase'].append(row.increase)
+        columns['price_before'].append(row.price_before)
+        columns['price_after'].append(row.price_after)
+        columns['item_id'].append(row.item_id if row.item_id is not None else 0)
+        columns['flags'].append(flags)
+        for name, (offsets, heap) in strings.items():
+            heap += (getattr(row, name) or '').encode()
+            offsets.append(len(heap))
+        search_index.add(build_search_text(
+            row.item_brand, row.item_name, '' if row.item_id is None else row.item_id, row.price_before, row.price_after
+        ), row_id)
+        if row.item_id is not None:
+            item_index.add(row.item_id, row_id)
+    for name, (offsets, heap) in strings.items():
+        columns[f'{name}_offsets'] = offsets
+        columns[f'{name}_heap'] = heap
+    columns.update(search_index.columns())
+    columns.update(item_index.columns())
+    return columns
+
+
+def increase_order(increases, start=0):
+    # sorted() is stable, so rows with the same increase stay in row order.
+    return sorted(range(start, len(increases)), key=increases.__getitem__)
+
+
+class ItemIndex(Mapping):
+    """Row numbers of every update for each item_id, oldest first, read from snapshot columns."""
+
+    __slots__ = ('item_ids', 'rows')
+
+    def __init__(self, item_ids, rows):
+        self.item_ids = item_ids
+        self.rows = rows
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(
+            columns['item_index_ids'].cast('q'),
+            ListColumn(columns['item_index_offsets'].cast('I'), columns['item_index_rows'].cast('I'))
+        )
+
+    def __getitem__(self, item_id):
+        position = bisect_left(self.item_ids, item_id)
+        if position == len(self.item_ids) or self.item_ids[position] != item_id:
+            raise KeyError(item_id)
+        return self.rows[position]
+
+    def __iter__(self):
+        return iter(self.item_ids)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+
+class ItemIndexBuilder:
+    """Collects (item_id, row_id) pairs for rows numbered after every row of index, if one is given, and encodes the combined index."""
+
+    def __init__(self, index=None):
+        self.index = index
+        self.rows = {}
+
+    def add(self, item_id, row_id):
+        rows = self.rows.get(item_id)
+        if rows is None:
+            rows = self.rows[item_id] = array('I')
+        rows.append(row_id)
+
+    def columns(self):
+        old_ids, old_rows = (self.index.item_ids, self.index.rows) if self.index is not None else ((), ())
+        item_ids = sorted(set(old_ids).union(self.rows))
+        offsets, rows = merge_lists(old_ids, old_rows, self.rows)
+        return {'item_index_ids': array('q', item_ids), 'item_index_offsets': offsets, 'item_index_rows': rows}
+
+
+class FeedSnapshot:
+    """
+    Read-only, columnar view of every update in the feed.
+    Rows are stored oldest first, ordered by (timestamp, id), so the newest
+    update is always the last row and row numbers only grow as data is added.
+    The columns live in a single buffer (usually a memory-mapped file shared
+    by every worker), along with the search and item indexes, and rows are
+    only turned into Python objects when they are returned.
+    """
+
+    __slots__ = (
+        'buffer', 'header', 'timestamps', 'increases', 'prices_before', 'prices_after',
+        'item_ids', 'flags', 'by_increase', 'ids', 'item_brands', 'item_names',
+        'image_urls', 'search_index', 'item_index'
+    )
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a feed snapshot")
+        header_length = int.from_bytes(view[8:12], 'little')
+        self.buffer = buffer
+        self.header = json_util.loads(bytes(view[12:12 + header_length]).decode())
+        data = view[align(12 + header_length):]
+        columns = {name: data[offset:offset + length] for name, (offset, length) in self.header['columns'].items()}
+
+        for name, (attribute, typecode) in NUMERIC_COLUMNS.items():
+            setattr(self, attribute, columns[name].cast(typecode))
+        for name, attribute in STRING_COLUMNS.items():
+            setattr(self, attribute, StringColumn(columns[f'{name}_offsets'].cast('I'), columns[f'{name}_heap']))
+        self.by_increase = columns['by_increase'].cast('I')
+        self.search_index = SearchIndex.from_columns(columns)
+        self.item_index = ItemIndex.from_columns(columns)
+
+    def item_rows(self, item_id):
+        return self.item_index.get(item_id, ())
+
+    @classmethod
+    def from_documents(cls, documents):
+        """Build an in-memory snapshot, mostly useful outside the FeedCache."""
+        rows, last_id = rows_from_documents(documents)
+        return cls(b''.join(full_snapshot(encode_rows(rows), last_id, generation=1)))
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @property
+    def generation(self):
+        return self.header['generation']
+
+    @property
+    def last_id(self):
+        return self.header['last_id']
+
+    @property
+    def created_at(self):
+        return dt.fromtimestamp(self.header['created_at'], utc_tz)
+
+    @property
+    def built_at(self):
+        return dt.fromtimestamp(self.header['built_at'], utc_tz)
+
+    def __len__(self):
+        return self.header['rows']
+
+    def price(self, index, column, flag):
+        value = column[index]
+        return int(value) if self.flags[index] & flag else value
+
+    def search_text(self, index):
+        item_id = '' if self.flags[index] & NO_ITEM_ID else self.item_ids[index]
+        return build_search_text(
+            self.item_brands[index], self.item_names[index], item_id,
+            self.price(index, self.prices_before, PRICE_BEFORE_INT),
+            self.price(index, self.prices_after, PRICE_AFTER_INT)
+        )
+
+    def date(self, index):
+        """UTC datetime of a row."""
+        return utc_epoch + timedelta(microseconds=round(self.timestamps[index] * 1_000_000))
+
+    def row(self, index):
+        flags = self.flags[index]
+        timestamp = self.timestamps[index]
+        date_obj = self.date(index)
+        return FeedRow(
+            id=self.ids[index],
+            item_id=None if flags & NO_ITEM_ID else self.item_ids[index],
+            item_brand=self.item_brands[index],
+            item_name=self.item_names[index],
+            price_before=self.price(index, self.prices_before, PRICE_BEFORE_INT),
+            price_after=self.price(index, self.prices_after, PRICE_AFTER_INT),
+            image_url=None if flags & NO_IMAGE else self.image_urls[index],
+            date=date_obj,
+            date_iso=date_obj.isoformat(),
+            date_formatted_utc=date_obj.strftime('%d/%m/%Y %H:%M:%S UTC'),
+            timestamp=timestamp,
+            increase=self.increases[index],
+            search_text=self.search_text(index)
+        )
+
+    def record(self, index):
+        """The FeedRecord the row was stored from."""
+        flags = self.flags[index]
+        return FeedRecord(
+            self.timestamps[index],
+            self.ids[index],
+            None if flags & NO_ITEM_ID else self.item_ids[index],
+            self.item_brands[index],
+            self.item_names[index],
+            self.price(index, self.prices_before, PRICE_BEFORE_INT),
+            self.price(index, self.prices_after, PRICE_AFTER_INT),
+            None if flags & NO_IMAGE else self.image_urls[index],
+            self.increases[index]
+        )
+
+    def newest(self, count):
+        """Row numbers of the newest updates, newest first."""
+        total = len(self)
+        return range(total - 1, max(total - count, 0) - 1, -1)
+
+    def between(self, start, end):
+        """Row numbers with start <= timestamp < end, oldest first."""
+        return range(bisect_left(self.timestamps, start), bisect_left(self.timestamps, end))
+
+    def search(self, term):
+        """Ascending row numbers whose search text contains term."""
+        return self.search_index.search(term)
+
+    def date_key(self, index):
+        return self.timestamps[index], self.ids[index]
+
+    def increase_key(self, index):
+        return self.increases[index], self.timestamps[index], self.ids[index]
+
+    def sort_key(self, index, sort_by):
+        return self.increase_key(index) if sort_by == 'increase' else self.date_key(index)
+
+    def position(self, date_key):
+        """Row number a (timestamp, id) key sorts at."""
+        return bisect_left(range(len(self)), date_key, key=self.date_key)
+
+    def contains(self, row):
+        position = self.position((row.timestamp, row.id))
+        return position < len(self) and self.date_key(position) == (row.timestamp, row.id)
+
+    def increase_position(self, index):
+        return self.increases[index], index
+
+    def page(self, sort_by='date', selection=None, offset=0, limit=9, after=None):
+        """
+        Row numbers of one page, newest (or biggest increase) first.
+        selection restricts the rows to an ascending sequence of row numbers,
+        after is a sort key and limits the page to rows that sort after it.
+        Unfiltered pages and date-sorted pages are sliced straight out of the
+        presorted orderings; a filtered increase sort only keeps a heap of
+        offset + limit rows while it walks the selection.
+        """
+        if sort_by == 'increase':
+            # Rows are in (timestamp, id) order, so (increase, row number)
+            # orders rows exactly like the full increase key does.
+            bound = None if after is None else (after[0], self.position(after[1:]))
+            if selection is None:
+                order = self.by_increase
+                stop = len(order) if bound is None else bisect_left(order, bound, key=self.increase_position)
+                return [order[stop - 1 - i] for i in range(offset, min(offset + limit, stop))]
+            candidates = selection
+            if bound is not None:
+                candidates = (i for i in selection if self.increase_position(i) < bound)
+            return heapq.nlargest(offset + limit, candidates, key=self.increase_position)[offset:]
+
+        if selection is None:
+            selection = range(len(self))
+        stop = len(selection)
+        if after is not None:
+            stop = bisect_left(selection, self.position(after))
+        return [selection[stop - 1 - i] for i in range(offset, min(offset + limit, stop))]
+
+    def serialize(self, index, user_tz):
+        """Build the JSON/template representation of a single row."""
+        row = self.row(index)
+        message = row._asdict()
+        message['_id'] = message.pop('id')
+        message['date_formatted_local'] = format_local(row, user_tz)
+        return message
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def snapshot_chunks(header, columns):
+    """Serialize a header and {name: [chunk, ...]} columns into the snapshot layout."""
+    offset = 0
+    layout = {}
+    for name, chunks in columns.items():
+        length = sum(memoryview(chunk).nbytes for chunk in chunks)
+        layout[name] = [offset, length]
+        offset = align(offset + length)
+    encoded = json_util.dumps({**header, 'columns': layout}).encode()
+
+    yield MAGIC
+    yield len(encoded).to_bytes(4, 'little')
+    yield encoded
+    yield bytes(align(12 + len(encoded)) - 12 - len(encoded))
+    for name, chunks in columns.items():
+        length = 0
+        for chunk in chunks:
+            length += memoryview(chunk).nbytes
+            yield chunk
+        yield bytes(align(length) - length)
+
+
+def full_snapshot(columns, last_id, generation, built_at=None):
+    """Snapshot chunks for the encode_rows() columns of rows sorted oldest first."""
+    columns['by_increase'] = array('I', increase_order(columns['increase']))
+    now = dt.now(utc_tz).timestamp()
+    header = {
+        'rows': len(columns['timestamp']),
+        'generation': generation,
+        'created_at': now,
+        'built_at': built_at or now,
+        'last_id': last_id,
+    }
+    return snapshot_chunks(header, {name: [column] for name, column in columns.items()})
+
+
+def appended_snapshot(snapshot, rows, last_id):
+    """
+    Snapshot chunks for snapshot with rows (all newer than its newest row)
+    appended. Existing columns are copied straight out of the old buffer;
+    the increase ordering and the indexes are merged with the new rows.
+    """
+    start = len(snapshot)
+    new_columns = encode_rows(rows, snapshot)
+    columns = {}
+    for name, (attribute, _) in NUMERIC_COLUMNS.items():
+        columns[name] = [getattr(snapshot, attribute).cast('B'), new_columns[name]]
+    for name, attribute in STRING_COLUMNS.items():
+        old = getattr(snapshot, attribute)
+        heap_length = old.offsets[-1]
+        new_offsets = array('I', (heap_length + offset for offset in new_columns[f'{name}_offsets'][1:]))
+        columns[f'{name}_offsets'] = [old.offsets.cast('B'), new_offsets]
+        columns[f'{name}_heap'] = [old.heap, new_columns[f'{name}_heap']]
+    # What's left are the index columns, which already cover every row.
+    for name, column in new_columns.items():
+        columns.setdefault(name, [column])
+
+    increases = array('d', snapshot.increases)
+    increases.extend(new_columns['increase'])
+    increase_key = lambda i: (increases[i], i)
+    if len(rows) > 256:
+        by_increase = array('I', heapq.merge(snapshot.by_increase, increase_order(increases, start), key=increase_key))
+    else:
+        by_increase = array('I', snapshot.by_increase)
+        for row_id in range(start, len(increases)):
+            by_increase.insert(bisect_left(by_increase, increase_key(row_id), key=increase_key), row_id)
+    columns['by_increase'] = [by_increase]
+
+    header = {
+        'rows': start + len(rows),
+        'generation': snapshot.generation + 1,
+        'created_at': dt.now(utc_tz).timestamp(),
+        'built_at': snapshot.header['built_at'],
+        'last_id': last_id,
+        'appended_to': snapshot.generation,
+        'appended_from': start,
+    }
+    return snapshot_chunks(header, columns)
+
+
+def write_snapshot(path, chunks):
+    """Write a snapshot next to path and atomically rename it into place."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(temp_path, path)
+
+
+@contextmanager
+def try_file_lock(path):
+    """Yield True if this process got the exclusive lock at path, False if someone else holds it."""
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class FeedCache:
+    """
+    Holds the current FeedSnapshot and keeps it fresh from a background thread.
+    The snapshot is kept in a file at path that every worker maps read-only,
+    so the page cache holds a single copy no matter how many workers there
+    are. Whichever worker grabs the lock file polls Mongo and writes the next
+    generation; everyone else just maps the new file once it's renamed into
+    place.
+
+    Requests always read whatever snapshot is current; once the first one has
+    loaded they never wait on Mongo. New updates are polled for every
+    poll_seconds, and the whole feed is reloaded once a day after rebuild_at
+    (UTC) to pick up edited or deleted documents.
+    """
+
+    def __init__(self, get_collection, path, poll_seconds=120, rebuild_at=time(20, 0), logger=None):
+        self.get_collection = get_collection
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.rebuild_at = rebuild_at
+        self.logger = logger or logging.getLogger(__name__)
+        self.snapshot = None
+        self.file_id = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """Start the refresher thread for this process, loading the first snapshot straight away."""
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name='feed-refresher', daemon=True)
+        self.thread.start()
+
+    def get(self):
+        """Current snapshot, blocking only if nothing has been loaded yet."""
+        if self.pid != os.getpid():
+            self.start()
+        if self.snapshot is None:
+            with self.lock:
+                if self.snapshot is None:
+                    self._load_latest()
+                if self.snapshot is None:
+                    self._update(wait=True)
+                    self._load_latest()
+        return self.snapshot
+
+    def rebuild_due(self, built_at, now=None):
+        """True once the daily rebuild time has passed since built_at."""
+        now = now or dt.now(utc_tz)
+        last_rollover = now.replace(hour=self.rebuild_at.hour, minute=self.rebuild_at.minute, second=0, microsecond=0)
+        if now < last_rollover:
+            last_rollover -= timedelta(days=1)
+        return built_at < last_rollover
+
+    def refresh(self):
+        """Bring the snapshot up to date, swapping the new one in when it is ready."""
+        with self.lock:
+            self._update()
+            self._load_latest()
+            self.checked_at = dt.now(utc_tz)
+
+    def _update(self, wait=False):
+        """Poll Mongo and write the next generation, unless another worker is already doing it."""
+        while True:
+            with try_file_lock(f"{self.path}.lock") as locked:
+                if locked:
+                    self._write_next_generation()
+                    return
+            if not wait:
+                return
+            sleep(0.1)
+
+    def _write_next_generation(self):
+        current = self._load_latest()
+        if current is None or self.rebuild_due(current.built_at):
+            # Sorted by the date index, so each batch goes straight into the
+            # columns instead of the whole feed being held and sorted here.
+            records = RecordStream(
+                self.get_collection().find({}, FEED_PROJECTION, batch_size=FEED_BATCH_SIZE).sort("date", 1)
+            )
+            generation = current.generation + 1 if current else 1
+            columns = encode_rows(records)
+            write_snapshot(self.path, full_snapshot(columns, records.last_id, generation))
+            self.logger.info(f"Loaded {len(columns['timestamp'])} feed updates (generation {generation}).")
+            return
+
+        query = {} if current.last_id is None else {"_id": {"$gt": poll_from(current.last_id)}}
+        rows, last_id = rows_from_documents(
+            self.get_collection().find(query, FEED_PROJECTION, batch_size=FEED_BATCH_SIZE).sort("_id", 1)
+        )
+        rows = [row for row in rows if not current.contains(row)]
+        last_id = max_id(current.last_id, last_id)
+        if not rows and last_id == current.last_id:
+            return
+        if rows and len(current) and current.date_key(len(current) - 1) >= (rows[0].timestamp, rows[0].id):
+            # Something landed in the middle of the feed, so merge the new rows
+            # into the current ones and rebuild the columns.
+            records = heapq.merge((current.record(i) for i in range(len(current))), rows)
+            write_snapshot(self.path, full_snapshot(encode_rows(records), last_id, current.generation + 1, current.header['built_at']))
+        else:
+            write_snapshot(self.path, appended_snapshot(current, rows, last_id))
+
+    def _load_latest(self):
+        """Map the snapshot file if it has changed since the one being served."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_id == self.file_id:
+            return self.snapshot
+        try:
+            snapshot = FeedSnapshot.open(self.path)
+        except (ValueError, KeyError, OSError) as e:
+            self.logger.warning(f"Ignoring unreadable feed snapshot {self.path}: {e}")
+            return None
+        self.snapshot, self.file_id = snapshot, file_id
+        return snapshot
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.warning(f"Failed to refresh the feed: {e}. Serving cached data.")
+            sleep(self.poll_seconds)
+
+    def info(self):
+        """Generation, age and size of the snapshot currently being served."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        now = dt.now(utc_tz)
+        return {
+            'generation': snapshot.generation,
+            'rows': len(snapshot),
+            'created_at': snapshot.created_at.strftime('%Y-%m-%d %H:%M:%S UTC'),
+            'age_seconds': round((now - snapshot.created_at).total_seconds()),
+            'checked_at': self.checked_at.strftime('%Y-%m-%d %H:%M:%S UTC') if self.checked_at else None,
+            'built_at': snapshot.built_at.strftime('%Y-%m-%d %H:%M:%S UTC')
+        }
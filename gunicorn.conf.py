@@ -0,0 +1,15 @@
+import os
+import threading
+
+
+def post_worker_init(worker):
+    """
+    Start loading the feed, connecting to Mongo and fetching Cloudflare's
+    networks as soon as a worker boots, before it takes any requests. The worker gets its own MongoClient here
+    rather than sharing one created before the fork.
+    """
+    from app import cloudflare_allowlist, feed_cache, warm_up_mongo
+    threading.Thread(target=warm_up_mongo, daemon=True).start()
+    feed_cache.start()
+    if os.environ.get('FLY_APP_NAME'):
+        cloudflare_allowlist.start()
@@ -0,0 +1,83 @@
+from datetime import datetime as dt
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from feed import FEED_PROJECTION, utc_tz
+from wrapped import wrapped_pipeline
+
+# Indexes every query the app runs against coles_updates relies on.
+COLES_UPDATES_INDEXES = [
+    # Full feed rebuilds read in date order, Wrapped reports match a date range.
+    [("date", DESCENDING)],
+    # Item price history lookups.
+    [("item_id", ASCENDING), ("date", ASCENDING)],
+]
+
+# Plan stages that mean a query isn't using an index the way it should.
+BAD_STAGES = {
+    'COLLSCAN': 'collection scan',
+    'SORT': 'in-memory sort',
+}
+
+
+def ensure_indexes(collection):
+    """Create any missing indexes and return the names of the ones that were added."""
+    existing = {tuple((field, int(direction)) for field, direction in index['key'].items()) for index in collection.list_indexes()}
+    created = []
+    for keys in COLES_UPDATES_INDEXES:
+        if tuple(keys) not in existing:
+            created.append(collection.create_index(keys))
+    return created
+
+
+def query_shapes(collection):
+    """
+    (name, function returning its explain output) for every query shape the
+    app runs against coles_updates.
+    """
+    def explain_aggregate(pipeline):
+        return collection.database.command(
+            'explain', {'aggregate': collection.name, 'pipeline': pipeline, 'cursor': {}},
+            verbosity='queryPlanner'
+        )
+
+    return [
+        ('feed rebuild', lambda: collection.find({}, FEED_PROJECTION).sort("date", 1).explain()),
+        ('feed poll', lambda: collection.find({"_id": {"$gt": ObjectId()}}, FEED_PROJECTION).sort("_id", 1).explain()),
+        ('item history', lambda: collection.find({"item_id": {"$in": [0, 1]}}, FEED_PROJECTION).sort([("item_id", 1), ("date", 1)]).explain()),
+        ('wrapped report', lambda: explain_aggregate(wrapped_pipeline(dt.now(utc_tz).year))),
+    ]
+
+
+def winning_plans(explain):
+    """Every winningPlan in an explain document, including the ones nested in aggregation stages."""
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == 'winningPlan':
+                yield value
+            else:
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from winning_plans(value)
+
+
+def plan_stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+
+def check_query_plans(collection):
+    """Explain every query shape and return (name, problem) for each one that scans or sorts in memory."""
+    problems = []
+    for name, explain in query_shapes(collection):
+        stages = {stage for plan in winning_plans(explain()) for stage in plan_stages(plan)}
+        problems.extend((name, problem) for stage, problem in BAD_STAGES.items() if stage in stages)
+    return problems
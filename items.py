@@ -0,0 +1,151 @@
+from collections import namedtuple
+from datetime import datetime as dt
+
+from caching import LRUCache
+from feed import utc_tz
+
+# Price history charts start from the price before the first recorded
+# change, plotted on the day data collection started.
+FIRST_RECORDED = dt(2024, 9, 8, tzinfo=utc_tz).timestamp()
+
+ItemHistory = namedtuple('ItemHistory', [
+    'item_brand', 'item_name', 'image_url', 'timestamps', 'prices',
+    'lowest_price', 'highest_price', 'percentage_change_extremes', 'total_price_changes',
+    'latest_price_before', 'latest_price_after', 'change', 'percentage_change_latest'
+])
+
+
+def build_item_history(rows):
+    """Precompute the timezone-independent price series and stats for an item's rows (oldest first)."""
+    if not rows:
+        return None
+
+    first_record = rows[0]
+    initial_price_before = first_record.price_before
+    points = {(FIRST_RECORDED, initial_price_before)}
+    points.update((row.timestamp, row.price_after) for row in rows)
+    points = sorted(points)
+    prices = [price for _, price in points]
+
+    total_prices = [initial_price_before] + prices
+    lowest_price = min(total_prices)
+    highest_price = max(total_prices)
+    percentage_change_extremes = ((highest_price - lowest_price) / lowest_price) * 100 if lowest_price else 0
+
+    total_price_changes = 0
+    previous_price = initial_price_before
+    for current_price in prices:
+        if previous_price != current_price:
+            total_price_changes += 1
+        previous_price = current_price
+
+    latest_record = rows[-1]
+    latest_price_before = latest_record.price_before
+    latest_price_after = latest_record.price_after
+    change = latest_price_after - latest_price_before if isinstance(latest_price_before, (int, float)) and isinstance(latest_price_after, (int, float)) else "N/A"
+    percentage_change_latest = ((change) / latest_price_before * 100) if isinstance(change, (int, float)) and latest_price_before != 0 else "N/A"
+
+    return ItemHistory(
+        item_brand=first_record.item_brand or 'Unknown Brand',
+        item_name=first_record.item_name or 'Unknown Name',
+        image_url=first_record.image_url,
+        timestamps=tuple(timestamp for timestamp, _ in points),
+        prices=tuple(prices),
+        lowest_price=lowest_price,
+        highest_price=highest_price,
+        percentage_change_extremes=percentage_change_extremes,
+        total_price_changes=total_price_changes,
+        latest_price_before=latest_price_before,
+        latest_price_after=latest_price_after,
+        change=change,
+        percentage_change_latest=percentage_change_latest
+    )
+
+
+def format_dates(history, user_tz, indexes=None):
+    timestamps = history.timestamps if indexes is None else [history.timestamps[i] for i in indexes]
+    return [dt.fromtimestamp(timestamp, user_tz).strftime('%d/%m/%Y') for timestamp in timestamps]
+
+
+def downsample(xs, ys, max_points):
+    """
+    Indexes of at most max_points points that keep the shape of the series,
+    chosen with Largest-Triangle-Three-Buckets. The first and last points
+    are always kept, and each bucket in between keeps the point that makes
+    the largest triangle with the point kept before it and the average of
+    the next bucket.
+    """
+    count = len(xs)
+    if max_points >= count or max_points < 3:
+        return range(count)
+
+    kept = [0]
+    bucket_size = (count - 2) / (max_points - 2)
+    previous = 0
+    for bucket in range(max_points - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        if end >= next_end:
+            average_x, average_y = xs[count - 1], ys[count - 1]
+        else:
+            average_x = sum(xs[end:next_end]) / (next_end - end)
+            average_y = sum(ys[end:next_end]) / (next_end - end)
+
+        previous_x, previous_y = xs[previous], ys[previous]
+        best, best_area = start, -1
+        for i in range(start, end):
+            area = abs((previous_x - average_x) * (ys[i] - previous_y) - (previous_x - xs[i]) * (average_y - previous_y))
+            if area > best_area:
+                best, best_area = i, area
+        kept.append(best)
+        previous = best
+    kept.append(count - 1)
+    return kept
+
+
+class ItemCache:
+    """
+    LRU of precomputed item histories, built from the feed snapshot.
+    An entry stays valid while the snapshot it came from is the same build
+    (the daily full reload starts a new one) and the item has the same
+    number of rows, so polls that only add updates for other items don't
+    invalidate it. Items the snapshot doesn't know about yet are looked up
+    with load_rows, which takes a list of item_ids and returns their rows
+    by item_id in one query, and are rechecked on the next generation.
+    """
+
+    def __init__(self, load_rows, maxsize=1024):
+        self.load_rows = load_rows
+        self.entries = LRUCache(maxsize)
+
+    def get(self, snapshot, item_id):
+        """ItemHistory for item_id, or None if it has no updates."""
+        return self.get_many(snapshot, [item_id])[item_id]
+
+    def get_many(self, snapshot, item_ids):
+        """item_id -> ItemHistory (or None if it has no updates) for every item in item_ids."""
+        histories = {}
+        keys = {}
+        for item_id in item_ids:
+            row_ids = snapshot.item_rows(item_id)
+            if row_ids:
+                key = ('feed', snapshot.header['built_at'], len(row_ids))
+            else:
+                key = ('db', snapshot.generation)
+
+            entry = self.entries.get(item_id)
+            if entry is not None and entry[0] == key:
+                histories[item_id] = entry[1]
+            elif row_ids:
+                histories[item_id] = build_item_history([snapshot.record(i) for i in row_ids])
+                self.entries.put(item_id, (key, histories[item_id]))
+            else:
+                keys[item_id] = key
+
+        if keys:
+            rows = self.load_rows(list(keys))
+            for item_id, key in keys.items():
+                histories[item_id] = build_item_history(rows.get(item_id))
+                self.entries.put(item_id, (key, histories[item_id]))
+        return histories
@@ -0,0 +1,68 @@
+from caching import LRUCache
+from feed import format_local_date
+
+# Every field a message can have, as returned by FeedSnapshot.serialize().
+MESSAGE_FIELDS = frozenset([
+    '_id', 'item_id', 'item_brand', 'item_name', 'price_before', 'price_after',
+    'image_url', 'date', 'date_iso', 'date_formatted_utc', 'date_formatted_local',
+    'timestamp', 'increase', 'search_text'
+])
+
+# What the feed cards need, plus the _id and ISO date for other clients.
+DEFAULT_MESSAGE_FIELDS = (
+    '_id', 'date_iso', 'image_url', 'increase', 'item_brand', 'item_id',
+    'item_name', 'price_after', 'price_before', 'date_formatted_local'
+)
+
+
+def parse_fields(value):
+    """
+    Normalized field selection for a comma separated fields= argument.
+    Returns the default fields when value is empty and None if it names a
+    field that doesn't exist.
+    """
+    if not value:
+        return DEFAULT_MESSAGE_FIELDS
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    if not names or not names <= MESSAGE_FIELDS:
+        return None
+    # The timezone dependent field goes last so the rest can be cached.
+    return tuple(sorted(names - {'date_formatted_local'})) + (('date_formatted_local',) if 'date_formatted_local' in names else ())
+
+
+class MessageEncoder:
+    """
+    JSON encoding of feed rows for the API.
+    Each row's timezone-independent fields are encoded once per field
+    selection and cached by _id and the snapshot's build time, so encoding a
+    page is mostly a join of cached fragments and a daily rebuild that
+    corrects a row doesn't keep serving the old one.
+    """
+
+    def __init__(self, dumps, cache_size=20000):
+        self.dumps = dumps
+        self.fragments = LRUCache(cache_size)
+
+    def fragment(self, snapshot, index, fields):
+        key = (snapshot.header['built_at'], snapshot.ids[index], fields)
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            message = snapshot.row(index)._asdict()
+            message['_id'] = message.pop('id')
+            fragment = ','.join(
+                f'"{name}":{self.dumps(message[name])}' for name in fields if name != 'date_formatted_local'
+            )
+            self.fragments.put(key, fragment)
+        return fragment
+
+    def encode(self, snapshot, indexes, fields, user_tz):
+        """JSON array of the messages for row numbers indexes."""
+        local = fields[-1] == 'date_formatted_local'
+        parts = []
+        for index in indexes:
+            fragment = self.fragment(snapshot, index, fields)
+            if local:
+                date_local = self.dumps(format_local_date(snapshot.date(index), user_tz))
+                fragment = f'{fragment},"date_formatted_local":{date_local}' if fragment else f'"date_formatted_local":{date_local}'
+            parts.append(f'{{{fragment}}}')
+        return f"[{','.join(parts)}]"
@@ -0,0 +1,221 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+# Histogram bucket bounds in seconds. Most requests are served from memory
+# in well under a millisecond, so the low end is finer than usual.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests served, by route and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time spent handling requests, by route.'),
+    'request_phase_duration_seconds': ('histogram', 'Time requests spent in each phase, by route. Time outside any phase is counted as app.'),
+    'mongo_command_duration_seconds': ('histogram', 'MongoDB command round trips, by command.'),
+}
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def resident_memory():
+    """Resident set size of this process in bytes, or None where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestTimer:
+    """
+    Splits one request's wall time between the phases it enters. Entering a
+    phase pauses the one it's nested in, so the phases always add up to the
+    total and a Mongo query made while loading the feed isn't counted twice.
+    """
+
+    __slots__ = ('start', 'mark', 'stack', 'phases')
+
+    def __init__(self):
+        self.start = self.mark = time.perf_counter()
+        self.stack = ['app']
+        self.phases = {}
+
+    def _charge(self):
+        now = time.perf_counter()
+        phase = self.stack[-1]
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.mark
+        self.mark = now
+
+    def enter(self, phase):
+        self._charge()
+        self.stack.append(phase)
+
+    def leave(self, phase):
+        if self.stack[-1] == phase:
+            self._charge()
+            self.stack.pop()
+
+    def finish(self):
+        self._charge()
+        return self.mark - self.start
+
+
+class Metrics:
+    """
+    Per-worker request metrics in the Prometheus text format.
+    Routes mark their phases with phase(); each request's phase times are
+    returned by finish_request() for its Server-Timing header and added to
+    histograms by route. Gauges that are cheap to read at scrape time (cache
+    sizes, snapshot age, memory) come from functions passed to collect().
+
+    Every series is labelled with the worker's pid. Each gunicorn worker only
+    reports its own counters, so a scrape sees whichever worker accepted it:
+    sum by route/status across worker labels in queries, and scrape each
+    worker (or every worker often enough) to see them all. Without the label
+    consecutive scrapes of different workers would look like counter resets.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start_request(self):
+        self.local.timer = RequestTimer()
+
+    def finish_request(self, route, status):
+        """(phase -> seconds, total seconds) for the current request, or None outside one."""
+        timer = getattr(self.local, 'timer', None)
+        if timer is None:
+            return None
+        self.local.timer = None
+        total = timer.finish()
+        route = (('route', route),)
+        with self.lock:
+            self._observe('http_request_duration_seconds', route, total)
+            for phase, seconds in timer.phases.items():
+                self._observe('request_phase_duration_seconds', route + (('phase', phase),), seconds)
+            key = ('http_requests_total', route + (('status', status),))
+            self.counters[key] = self.counters.get(key, 0) + 1
+        return timer.phases, total
+
+    def enter(self, phase):
+        timer = getattr(self.local, 'timer', None)
+        if timer is not None:
+            timer.enter(phase)
+
+    def leave(self, phase):
+        timer = getattr(self.local, 'timer', None)
+        if timer is not None:
+            timer.leave(phase)
+
+    @contextmanager
+    def phase(self, phase):
+        self.enter(phase)
+        try:
+            yield
+        finally:
+            self.leave(phase)
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            self._observe(name, labels, value)
+
+    def _observe(self, name, labels, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    def collect(self, function):
+        """Add a function yielding (name, type, help, labels, value) for every scrape."""
+        self.collectors.append(function)
+        return function
+
+    def render(self):
+        worker = (('worker', os.getpid()),)
+        families = {}
+
+        def family(name, kind=None, help=None):
+            if name not in families:
+                default_kind, default_help = METRICS.get(name, (kind, help))
+                families[name] = (kind or default_kind, help or default_help, [])
+            return families[name][2]
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                family(name).append(f"{name}{format_labels(worker + labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                lines = family(name)
+                labels = worker + labels
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        for collector in self.collectors:
+            for name, kind, help, labels, value in collector():
+                if value is not None:
+                    family(name, kind, help).append(f"{name}{format_labels(worker + tuple(labels))} {value}")
+
+        output = []
+        for name, (kind, help, lines) in families.items():
+            output.append(f"# HELP {name} {help}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    Times every MongoDB command. pymongo calls listeners on the thread that
+    runs the command, so the time is also charged to the mongo phase of the
+    request being served, if any.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        self.metrics.enter('mongo')
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        self.metrics.leave('mongo')
+        self.metrics.observe('mongo_command_duration_seconds', (('command', event.command_name),), event.duration_micros / 1e6)
@@ -0,0 +1,68 @@
+from collections import Counter
+from time import sleep
+import logging
+import os
+import sys
+import threading
+
+
+def folded_stack(frame, depth=48):
+    """A frame's call stack as 'file:function:line;...' from the outermost call, like flamegraph.pl takes."""
+    calls = []
+    while frame is not None and len(calls) < depth:
+        code = frame.f_code
+        calls.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(calls))
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of in-flight requests from a background thread and
+    logs where the time went for requests slower than threshold seconds.
+    The cost while it's on is one stack walk per in-flight request every
+    interval seconds, so it is only switched on when asked for.
+    """
+
+    def __init__(self, threshold, interval=0.005, top=10, logger=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self.logger = logger or logging.getLogger(__name__)
+        self.samples = {}
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """Start the sampler thread for this process."""
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self.thread.start()
+
+    def begin(self):
+        """Start sampling the current thread's request."""
+        if self.pid != os.getpid():
+            self.start()
+        self.samples[threading.get_ident()] = Counter()
+
+    def end(self, description, seconds):
+        """Stop sampling the current thread's request and log its profile if it took longer than threshold."""
+        samples = self.samples.pop(threading.get_ident(), None)
+        if not samples or seconds < self.threshold:
+            return
+        total = sum(samples.values())
+        lines = [f"Slow request {description} took {seconds * 1000:.0f}ms, {total} samples every {self.interval * 1000:g}ms:"]
+        lines.extend(f"{count} {stack}" for stack, count in samples.most_common(self.top))
+        self.logger.warning('\n'.join(lines))
+
+    def _run(self):
+        while True:
+            sleep(self.interval)
+            frames = sys._current_frames()
+            for ident, samples in list(self.samples.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[folded_stack(frame)] += 1
+            del frames
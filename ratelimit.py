@@ -0,0 +1,99 @@
+import ipaddress
+import threading
+import time
+
+from caching import LRUCache
+
+
+def client_key(ip_str):
+    """What to rate limit a client by: its address, or its /64 for IPv6 since clients usually get a whole one."""
+    try:
+        address = ipaddress.ip_address(ip_str)
+    except ValueError:
+        return ip_str
+    if address.version == 6:
+        if address.ipv4_mapped:
+            return str(address.ipv4_mapped)
+        return str(ipaddress.IPv6Network((int(address) >> 64 << 64, 64)))
+    return str(address)
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets per client and cost class. classes maps each class to
+    (tokens added per second, burst size). Buckets are kept in an LRU, so
+    memory stays bounded however many clients show up; a client whose
+    bucket was evicted just comes back with a full one.
+    """
+
+    def __init__(self, classes, maxsize=10000):
+        self.classes = classes
+        self.buckets = LRUCache(maxsize)
+        self.lock = threading.Lock()
+
+    def take(self, client, cost_class, cost=1):
+        """0 if the client can afford cost tokens now (and takes them), otherwise the seconds until it can."""
+        rate, burst = self.classes[cost_class]
+        cost = min(cost, burst)
+        now = time.monotonic()
+        key = (client, cost_class)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = [burst, now]
+                self.buckets.put(key, bucket)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return 0
+            bucket[0] = tokens
+            return (cost - tokens) / rate
+
+
+class LoadMonitor:
+    """
+    This worker's in-flight requests and an exponentially weighted moving
+    average of how long they take, to tell when it is overloaded. The average
+    also decays towards zero with time, halving every half_life seconds, so a
+    worker that has shed everything and finished nothing since still recovers.
+    """
+
+    def __init__(self, max_in_flight, max_latency, alpha=0.1, half_life=5.0):
+        self.max_in_flight = max_in_flight
+        self.max_latency = max_latency
+        self.alpha = alpha
+        self.half_life = half_life
+        self.in_flight = 0
+        self._latency = 0.0
+        self._updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def latency(self, now=None):
+        """The moving average of request time in seconds, decayed to now."""
+        now = time.monotonic() if now is None else now
+        return self._latency * 0.5 ** ((now - self._updated) / self.half_life)
+
+    def overloaded(self):
+        return self.in_flight >= self.max_in_flight or self.latency() >= self.max_latency
+
+    def begin(self):
+        """Count the current thread's request as in flight."""
+        with self.lock:
+            self.in_flight += 1
+        self.local.start = time.perf_counter()
+
+    def end(self):
+        """Finish the current thread's request, if begin() was called for it."""
+        start = getattr(self.local, 'start', None)
+        if start is None:
+            return
+        self.local.start = None
+        seconds = time.perf_counter() - start
+        now = time.monotonic()
+        with self.lock:
+            self.in_flight -= 1
+            latency = self.latency(now)
+            self._latency = latency + self.alpha * (seconds - latency)
+            self._updated = now
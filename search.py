@@ -0,0 +1,276 @@
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import chain, compress, repeat
+
+from columns import ListColumn, StringColumn, encode_strings, merge_lists
+
+
+# Once a fragment matches more than 1/BROAD_FRACTION of the texts, checking
+# every row's text id against a bitmap is cheaper than merging their rows.
+BROAD_FRACTION = 8
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TextIndex:
+    """
+    Trigram index over a set of distinct strings, read from snapshot columns.
+    Every string keeps the (ascending) row numbers it appears in, so rows
+    that share the same text are only indexed once, and every trigram keeps
+    the (ascending) ids of the strings that contain it. row_keys has the id
+    of every row's string.
+    """
+
+    def __init__(self, texts, rows, trigrams, postings, row_keys):
+        self.texts = texts
+        self.rows = rows
+        self.trigrams = trigrams
+        self.postings = postings
+        self.row_keys = row_keys
+
+    @classmethod
+    def from_columns(cls, columns, prefix):
+        def column(name, typecode=None):
+            data = columns[f'{prefix}_{name}']
+            return data.cast(typecode) if typecode else data
+
+        return cls(
+            StringColumn(column('texts_offsets', 'I'), column('texts_heap')),
+            ListColumn(column('rows_offsets', 'I'), column('rows', 'I')),
+            StringColumn(column('trigrams_offsets', 'I'), column('trigrams_heap')),
+            ListColumn(column('postings_offsets', 'I'), column('postings', 'I')),
+            column('row_keys', 'I')
+        )
+
+    def posting(self, trigram):
+        position = bisect_left(self.trigrams, trigram)
+        if position < len(self.trigrams) and self.trigrams[position] == trigram:
+            return self.postings[position]
+        return None
+
+    def candidates(self, fragment):
+        """Key ids of every text that could contain fragment."""
+        if len(fragment) < 3:
+            return range(len(self.texts))
+        smallest = None
+        for trigram in trigrams(fragment):
+            posting = self.posting(trigram)
+            if posting is None:
+                return ()
+            if smallest is None or len(posting) < len(smallest):
+                smallest = posting
+        return smallest
+
+    def matching(self, fragment, test):
+        """
+        Key ids of the texts for which test(text, fragment) is true. The texts
+        are compared as UTF-8 straight out of the heap, which gives the same
+        answers as comparing the decoded strings.
+        """
+        key_ids = self.candidates(fragment)
+        heap, offsets = self.texts.heap, self.texts.offsets
+        texts = (bytes(heap[offsets[key_id]:offsets[key_id + 1]]) for key_id in key_ids)
+        return list(compress(key_ids, map(test, texts, repeat(fragment.encode()))))
+
+    def scan(self, fragment, where):
+        """
+        Key ids of the texts containing fragment (where='in'), starting with it
+        ('start') or ending with it ('end'), found by comparing the whole heap
+        at once. Used for fragments too short to have a trigram.
+        """
+        # numpy is only imported once a search needs it, like the stats.
+        import numpy as np
+
+        encoded = np.frombuffer(fragment.encode(), dtype=np.uint8)
+        heap = np.frombuffer(self.texts.heap, dtype=np.uint8)
+        offsets = np.frombuffer(self.texts.offsets, dtype=np.uint32).astype(np.int64)
+        size = len(encoded)
+        if where == 'in':
+            found = np.ones(max(len(heap) - size + 1, 0), dtype=bool)
+            for i, byte in enumerate(encoded):
+                found &= heap[i:len(heap) - size + 1 + i] == byte
+            positions = np.flatnonzero(found)
+            key_ids = np.searchsorted(offsets, positions, side='right') - 1
+            key_ids = key_ids[positions + size <= offsets[key_ids + 1]]
+            # Positions are ascending, so repeats of a key id are adjacent.
+            return key_ids[np.diff(key_ids, prepend=-1) != 0].tolist()
+        starts = offsets[:-1] if where == 'start' else offsets[1:] - size
+        key_ids = np.flatnonzero(offsets[1:] - offsets[:-1] >= size)
+        for i, byte in enumerate(encoded):
+            key_ids = key_ids[heap[starts[key_ids] + i] == byte]
+        return key_ids.tolist()
+
+    def containing(self, fragment):
+        if len(fragment) < 3:
+            return self.scan(fragment, 'in')
+        return self.matching(fragment, bytes.__contains__)
+
+    def starting_with(self, fragment):
+        if len(fragment) < 3:
+            return self.scan(fragment, 'start')
+        return self.matching(fragment, bytes.startswith)
+
+    def ending_with(self, fragment):
+        if len(fragment) < 3:
+            return self.scan(fragment, 'end')
+        return self.matching(fragment, bytes.endswith)
+
+    def broad(self, key_ids):
+        return len(key_ids) * BROAD_FRACTION > len(self.texts)
+
+    def row_mask(self, key_ids):
+        """Bitmap of the rows whose text is one of key_ids."""
+        import numpy as np
+
+        texts = np.zeros(len(self.texts), dtype=bool)
+        texts[key_ids] = True
+        return texts[np.frombuffer(self.row_keys, dtype=np.uint32)]
+
+    def rows_for(self, key_ids):
+        # Every row has one text, so the texts' rows never overlap.
+        rows = [self.rows[key_id] for key_id in key_ids]
+        return rows[0] if len(rows) == 1 else array('I', sorted(chain.from_iterable(rows)))
+
+
+class TextIndexBuilder:
+    """
+    Collects (text, row_id) entries for rows numbered after every row of
+    index, if one is given, and encodes the columns of the combined index.
+    """
+
+    def __init__(self, index=None):
+        self.index = index
+        self.key_ids = {}
+        if index is not None:
+            # Keyed by the encoded texts, which can be sliced straight out of the heap.
+            heap, offsets = bytes(index.texts.heap), index.texts.offsets
+            self.key_ids = dict(zip(map(heap.__getitem__, map(slice, offsets[:-1], offsets[1:])), range(len(index.texts))))
+        self.new_texts = []
+        self.rows = {}
+        self.postings = {}
+        self.row_keys = array('I', index.row_keys) if index is not None else array('I')
+
+    def add(self, text, row_id):
+        encoded = text.encode()
+        key_id = self.key_ids.get(encoded)
+        if key_id is None:
+            key_id = self.key_ids[encoded] = len(self.key_ids)
+            self.new_texts.append(text)
+            for trigram in trigrams(text):
+                posting = self.postings.get(trigram)
+                if posting is None:
+                    posting = self.postings[trigram] = array('I')
+                posting.append(key_id)
+        rows = self.rows.get(key_id)
+        if rows is None:
+            rows = self.rows[key_id] = array('I')
+        rows.append(row_id)
+        self.row_keys.append(key_id)
+
+    def columns(self, prefix):
+        index = self.index
+        old_texts, old_rows, old_trigrams, old_postings = (
+            (index.texts, index.rows, index.trigrams, index.postings) if index is not None else (None, (), (), ())
+        )
+        columns = {}
+        columns['texts_offsets'], columns['texts_heap'] = encode_strings(self.new_texts, old_texts)
+        columns['rows_offsets'], columns['rows'] = merge_lists(range(len(old_rows)), old_rows, self.rows)
+        columns['trigrams_offsets'], columns['trigrams_heap'] = encode_strings(sorted(set(old_trigrams).union(self.postings)))
+        columns['postings_offsets'], columns['postings'] = merge_lists(old_trigrams, old_postings, self.postings)
+        columns['row_keys'] = self.row_keys
+        return {f'{prefix}_{name}': column for name, column in columns.items()}
+
+
+def merge_rows(groups):
+    """Union of ascending row number arrays, as one ascending array."""
+    if not groups:
+        return array('I')
+    if len(groups) == 1:
+        return groups[0]
+    return array('I', dict.fromkeys(sorted(chain.from_iterable(groups))))
+
+
+def split_search_text(search_text):
+    """Split a search text into its "<brand> <name> <item_id> " and "<before> <after>" parts."""
+    item_text, price_before, price_after = search_text.rsplit(' ', 2)
+    return item_text + ' ', f"{price_before} {price_after}"
+
+
+class SearchIndex:
+    """
+    Substring search over the feed's search text.
+    Each search text is "<brand> <name> <item_id> <price_before> <price_after>",
+    which is split into an item part and a price part that are indexed
+    separately. Results are exactly the rows whose search text contains the
+    term, returned as an ascending sequence of row numbers.
+    The index is stored in the feed snapshot's columns, so every worker
+    searches the same mapped copy; only the cache of recent results is its own.
+    """
+
+    def __init__(self, items, prices, cache_size=32):
+        self.items = items
+        self.prices = prices
+        self.search = lru_cache(maxsize=cache_size)(self._search)
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(TextIndex.from_columns(columns, 'search_items'), TextIndex.from_columns(columns, 'search_prices'))
+
+    def _search(self, term):
+        items, prices = self.items, self.prices
+        item_keys = items.containing(term)
+        price_keys = prices.containing(term)
+
+        # Terms that run from the end of the item part into the prices.
+        spans = []
+        for split in range(1, len(term)):
+            if term[split - 1] != ' ':
+                continue
+            head, tail = term[:split], term[split:]
+            price_starts = prices.starting_with(tail)
+            if not price_starts:
+                continue
+            if head == ' ':
+                price_keys = sorted(set(price_keys).union(price_starts))
+                continue
+            item_ends = items.ending_with(head)
+            if item_ends:
+                spans.append((item_ends, price_starts))
+
+        if items.broad(item_keys) or prices.broad(price_keys) or any(prices.broad(price_starts) for _, price_starts in spans):
+            # Most rows match, so check every row's texts against bitmaps of
+            # the matched ones instead.
+            import numpy as np
+
+            matched = items.row_mask(item_keys) | prices.row_mask(price_keys)
+            for item_ends, price_starts in spans:
+                matched |= items.row_mask(item_ends) & prices.row_mask(price_starts)
+            rows = array('I')
+            rows.frombytes(np.flatnonzero(matched).astype(np.uint32).tobytes())
+            return rows
+
+        groups = [items.rows_for(item_keys), prices.rows_for(price_keys)]
+        for item_ends, price_starts in spans:
+            price_rows = prices.rows_for(price_starts)
+            ends = set(item_ends)
+            groups.append(array('I', compress(price_rows, map(ends.__contains__, map(items.row_keys.__getitem__, price_rows)))))
+        return merge_rows([group for group in groups if group])
+
+
+class SearchIndexBuilder:
+    """Collects search texts for rows numbered after every row of index, if one is given, and encodes the combined index."""
+
+    def __init__(self, index=None):
+        self.items = TextIndexBuilder(index.items if index is not None else None)
+        self.prices = TextIndexBuilder(index.prices if index is not None else None)
+
+    def add(self, search_text, row_id):
+        item_text, price_text = split_search_text(search_text)
+        self.items.add(item_text, row_id)
+        self.prices.add(price_text, row_id)
+
+    def columns(self):
+        return {**self.items.columns('search_items'), **self.prices.columns('search_prices')}
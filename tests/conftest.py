@@ -0,0 +1,43 @@
+import os
+import sys
+
+import mongomock
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from generate import generate_documents  # noqa: E402
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient()['coles']['coles_updates']
+
+
+@pytest.fixture(scope='session')
+def documents():
+    return list(generate_documents(2000, seed=1))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory, documents):
+    """The app, importing it against a mongomock database of the generated documents."""
+    directory = tmp_path_factory.mktemp('app')
+    os.environ['FEED_SNAPSHOT_PATH'] = str(directory / 'feed.snapshot')
+    os.environ['CLOUDFLARE_CACHE_PATH'] = str(directory / 'cloudflare.txt')
+    os.environ['FEED_POLL_SECONDS'] = '3600'
+    os.environ['RATE_LIMITING'] = 'off'
+    os.environ.pop('FLY_APP_NAME', None)
+    import app
+
+    client = mongomock.MongoClient()
+    client['coles']['coles_updates'].insert_many([dict(document) for document in documents])
+    app.MongoClient = lambda *_, **__: client
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,30 @@
+import numpy as np
+
+from analytics import FeedAnalytics
+from feed import FeedSnapshot
+
+
+def test_highs_counts_new_all_time_highs(documents):
+    documents = [dict(document) for document in documents]
+    # Some prices fall, so not every update is a new high.
+    for document in documents[::3]:
+        document['price_after'] = round(document['price_before'] * 0.9, 2)
+    snapshot = FeedSnapshot.from_documents(documents)
+    analytics = FeedAnalytics(snapshot)
+
+    expected, highest = [], {}
+    for i in range(len(snapshot)):
+        record = snapshot.record(i)
+        high = highest.get(record.item_id, record.price_before)
+        expected.append(record.price_after > high)
+        highest[record.item_id] = max(high, record.price_after)
+    assert analytics.is_high.tolist() == expected
+    assert 0 < sum(expected) < len(expected)
+
+    edges = np.linspace(analytics.timestamps[len(snapshot) // 3], analytics.timestamps[-1] + 1, 13)
+    events, items = analytics.highs(edges)
+    buckets = np.searchsorted(edges, analytics.timestamps, side='right') - 1
+    for bucket in range(12):
+        rows = [i for i in range(len(snapshot)) if expected[i] and buckets[i] == bucket and edges[0] <= analytics.timestamps[i]]
+        assert events[bucket] == len(rows)
+        assert items[bucket] == len({snapshot.record(i).item_id for i in rows})
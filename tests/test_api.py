@@ -0,0 +1,62 @@
+from collections import Counter
+from datetime import timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+TIMEZONE = 'Australia/Sydney'
+HEADERS = {'Cookie': f'timezone={TIMEZONE}'}
+
+
+def get_json(client, url):
+    response = client.get(url, headers=HEADERS)
+    assert response.status_code == 200, url
+    return response.get_json()
+
+
+def busiest_local_date(documents):
+    dates = Counter(
+        document['date'].replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE)).strftime('%d/%m/%Y')
+        for document in documents
+    )
+    return dates.most_common(1)[0][0]
+
+
+@pytest.mark.parametrize('query', [
+    'per_page=50', 'sort=increase&per_page=50', 'search=milk&per_page=7',
+    'search=2&sort=increase&per_page=30', 'search=zzz', 'DATE&per_page=1', 'DATE&search=c&sort=increase&per_page=1',
+])
+def test_cursor_walk_returns_the_numbered_pages(client, documents, query):
+    query = query.replace('DATE', f'date={busiest_local_date(documents)}')
+    first = get_json(client, f'/api/messages?{query}')
+    by_page = [message['_id'] for message in first['messages']]
+    for page in range(2, first['total_pages'] + 1):
+        by_page += [message['_id'] for message in get_json(client, f'/api/messages?{query}&page={page}')['messages']]
+
+    by_cursor = [message['_id'] for message in first['messages']]
+    cursor = first['next_cursor']
+    while cursor:
+        body = get_json(client, f'/api/messages?{query}&after={cursor}')
+        by_cursor += [message['_id'] for message in body['messages']]
+        cursor = body['next_cursor']
+
+    assert by_cursor == by_page
+    assert len(set(by_page)) == len(by_page)
+    assert len(by_page) == first['total_count']
+
+
+def test_bad_cursor_is_rejected(client):
+    assert client.get('/api/messages?after=nonsense', headers=HEADERS).status_code == 400
+
+
+def test_item_batch_renders_items_from_a_zero_price(client, documents):
+    zero = sorted({document['item_id'] for document in documents if document['price_before'] == 0})[:3]
+    others = sorted({document['item_id'] for document in documents})[:5]
+    body = get_json(client, f"/api/items?ids={','.join(map(str, zero + others))}")
+    assert sorted(map(int, body['items'])) == sorted(set(zero + others))
+    assert body['missing'] == []
+
+
+@pytest.mark.parametrize('ids', ['', 'abc', str(2 ** 63), str(-2 ** 63 - 1)])
+def test_item_batch_rejects_bad_ids(client, ids):
+    assert client.get(f'/api/items?ids={ids}', headers=HEADERS).status_code == 400
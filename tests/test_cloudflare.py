@@ -0,0 +1,25 @@
+import ipaddress
+import random
+
+from cloudflare import NetworkSet
+
+NETWORKS = [
+    '173.245.48.0/20', '103.21.244.0/22', '103.22.200.0/22', '103.31.4.0/22', '141.101.64.0/18',
+    '108.162.192.0/18', '104.16.0.0/13', '104.24.0.0/14', '172.64.0.0/13', '131.0.72.0/22',
+    '104.16.0.0/12', '10.0.0.0/24', '10.0.1.0/24', '10.0.3.0/32',
+    '2400:cb00::/32', '2606:4700::/32', '2803:f800::/32', '2a06:98c0::/29', '2c0f:f248::/32',
+]
+
+
+def test_network_set_matches_linear_check():
+    networks = [ipaddress.ip_network(network) for network in NETWORKS]
+    network_set = NetworkSet(networks)
+    rng = random.Random(1)
+    addresses = []
+    for network in networks:
+        first, last = int(network.network_address), int(network.broadcast_address)
+        for value in (first - 1, first, last, last + 1, rng.randint(first, last)):
+            addresses.append(ipaddress.ip_address(value) if network.version == 4 else ipaddress.IPv6Address(value))
+    addresses += [ipaddress.ip_address(rng.getrandbits(32)) for _ in range(1000)]
+    for address in addresses:
+        assert (address in network_set) == any(address in network for network in networks), address
@@ -0,0 +1,74 @@
+from datetime import datetime as dt, timedelta, timezone
+import os
+import random
+
+import pytest
+from bson import ObjectId
+
+from feed import FEED_PROJECTION, FeedCache, FeedSnapshot
+from generate import generate_documents, make_object_id
+
+
+def assert_same_snapshot(snapshot, expected):
+    assert [snapshot.record(i) for i in range(len(snapshot))] == [expected.record(i) for i in range(len(expected))]
+    assert list(snapshot.by_increase) == list(expected.by_increase)
+    assert {item_id: list(rows) for item_id, rows in snapshot.item_index.items()} == \
+        {item_id: list(rows) for item_id, rows in expected.item_index.items()}
+
+
+def refreshed(feed_cache, collection):
+    feed_cache.refresh()
+    snapshot = feed_cache.get()
+    assert_same_snapshot(snapshot, FeedSnapshot.from_documents(collection.find({}, FEED_PROJECTION)))
+    return snapshot
+
+
+@pytest.fixture
+def feed_cache(collection, documents, tmp_path):
+    collection.insert_many([dict(document) for document in documents])
+    feed_cache = FeedCache(lambda: collection, str(tmp_path / 'feed.snapshot'), poll_seconds=3600)
+    # Refreshed by the tests rather than a background thread.
+    feed_cache.pid = os.getpid()
+    feed_cache.refresh()
+    return feed_cache
+
+
+def new_documents(count, dates, seed):
+    rng = random.Random(seed)
+    documents = list(generate_documents(count, seed=seed))
+    for document, date in zip(documents, dates):
+        document.update({'_id': make_object_id(dt.now(timezone.utc), rng), 'date': date})
+    return documents
+
+
+def test_refresh_appends_new_updates(feed_cache, collection):
+    generation = feed_cache.get().generation
+    now = dt.now(timezone.utc).replace(tzinfo=None)
+    collection.insert_many(new_documents(50, [now - timedelta(seconds=50 - i) for i in range(50)], seed=2))
+    snapshot = refreshed(feed_cache, collection)
+    assert snapshot.generation == generation + 1
+    assert snapshot.header.get('appended_to') == generation
+
+
+def test_refresh_merges_out_of_order_updates(feed_cache, collection):
+    snapshot = feed_cache.get()
+    middle = [snapshot.date(i).replace(tzinfo=None) + timedelta(seconds=1) for i in range(10, len(snapshot), len(snapshot) // 20)]
+    collection.insert_many(new_documents(len(middle), middle, seed=3))
+    assert len(refreshed(feed_cache, collection)) == len(snapshot) + len(middle)
+
+
+def test_refresh_orders_updates_with_the_same_date_by_id(feed_cache, collection):
+    snapshot = feed_cache.get()
+    newest = len(snapshot) - 1
+    same = [snapshot.date(i).replace(tzinfo=None) for i in (0, len(snapshot) // 2, newest, newest)]
+    documents = new_documents(len(same), same, seed=4)
+    # Minted in the same second as the newest update but sorting before it.
+    documents[-1]['_id'] = ObjectId(ObjectId(snapshot.ids[newest]).binary[:4] + bytes(8))
+    collection.insert_many(documents)
+    assert len(refreshed(feed_cache, collection)) == len(snapshot) + len(documents)
+
+
+def test_refresh_without_changes_keeps_the_generation(feed_cache, collection):
+    generation = feed_cache.get().generation
+    feed_cache.refresh()
+    assert feed_cache.get().generation == generation
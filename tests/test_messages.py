@@ -0,0 +1,17 @@
+import json
+from zoneinfo import ZoneInfo
+
+from messages import DEFAULT_MESSAGE_FIELDS, MESSAGE_FIELDS, MessageEncoder, parse_fields
+
+
+def test_encoder_matches_serialize(app_module):
+    snapshot = app_module.feed_cache.get()
+    user_tz = ZoneInfo('Australia/Perth')
+    encoder = MessageEncoder(app_module.message_encoder.dumps)
+    indexes = list(range(0, len(snapshot), 37))
+    for fields in (DEFAULT_MESSAGE_FIELDS, parse_fields(','.join(sorted(MESSAGE_FIELDS))), ('item_id',), ('date_formatted_local',)):
+        # The second pass is served from cached fragments.
+        for _ in range(2):
+            encoded = json.loads(encoder.encode(snapshot, indexes, fields, user_tz))
+            expected = [json.loads(app_module.message_encoder.dumps({name: snapshot.serialize(i, user_tz)[name] for name in fields})) for i in indexes]
+            assert encoded == expected
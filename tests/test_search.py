@@ -0,0 +1,47 @@
+from datetime import datetime as dt
+
+import pytest
+from bson import ObjectId
+
+from feed import FeedSnapshot, appended_snapshot, rows_from_documents
+
+UNICODE_DOCUMENTS = [
+    {'_id': ObjectId(), 'item_id': 9000 + i, 'item_brand': brand, 'item_name': 'größe 1 ü',
+     'price_before': 1, 'price_after': 2.5, 'image_url': None, 'date': dt(2024, 9, 9 + i)}
+    for i, brand in enumerate(['Nestlé', 'Café Crème', '日本', 'Über'])
+]
+
+TERMS = [
+    'milk', 'tim tam', 'coles', 'chips 170', 'dairy milk', '2.5', 'zzz', 'a', ' ', '1',
+    ' 1', 'g 1', '1 2', '00 ', '5 5', 'é', 'ü 1', '本', 'ße 1 ü 1', 'x' * 40,
+]
+
+
+@pytest.fixture(scope='module')
+def snapshots(documents):
+    documents = sorted(documents + UNICODE_DOCUMENTS, key=lambda document: (document['date'], document['_id']))
+    split = len(documents) * 9 // 10
+    base = FeedSnapshot.from_documents(documents[:split])
+    new_rows, new_last_id = rows_from_documents(documents[split:])
+    appended = FeedSnapshot(b''.join(appended_snapshot(base, new_rows, new_last_id)))
+    return FeedSnapshot.from_documents(documents), appended
+
+
+@pytest.mark.parametrize('term', TERMS)
+def test_search_matches_substring_scan(snapshots, term):
+    full, appended = snapshots
+    texts = [full.search_text(i) for i in range(len(full))]
+    expected = [i for i, text in enumerate(texts) if term in text]
+    assert list(full.search(term)) == expected
+    assert list(appended.search(term)) == expected
+
+
+def test_search_matches_substring_scan_for_fragments_of_rows(snapshots):
+    full, appended = snapshots
+    texts = [full.search_text(i) for i in range(len(full))]
+    for i in range(0, len(texts), 97):
+        for width in (2, 3, 5, 9):
+            term = texts[i][3:3 + width]
+            expected = [j for j, text in enumerate(texts) if term in text]
+            assert list(full.search(term)) == expected
+            assert list(appended.search(term)) == expected
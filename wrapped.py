@@ -0,0 +1,179 @@
+from datetime import datetime as dt
+import calendar
+import hashlib
+import threading
+
+from feed import utc_tz
+
+INCREASED = {"$expr": {"$gt": ["$price_after", "$price_before"]}}
+
+INCREASE_PCT = {
+    "$multiply": [
+        {"$divide": [{"$subtract": ["$price_after", "$price_before"]}, "$price_before"]},
+        100
+    ]
+}
+
+
+def year_range(year):
+    return dt(year, 1, 1, tzinfo=utc_tz), dt(year + 1, 1, 1, tzinfo=utc_tz)
+
+
+def wrapped_pipeline(year):
+    """One aggregation that computes every Wrapped statistic for a year."""
+    start_date, end_date = year_range(year)
+    return [
+        {"$match": {"date": {"$gte": start_date, "$lt": end_date}}},
+        {"$facet": {
+            "total_increases": [
+                {"$match": INCREASED},
+                {"$count": "count"}
+            ],
+            "top_pct_increases": [
+                {"$match": {"price_before": {"$ne": 0}}},
+                {"$project": {
+                    "item_brand": 1,
+                    "item_name": 1,
+                    "price_before": 1,
+                    "price_after": 1,
+                    "increase_pct": INCREASE_PCT
+                }},
+                {"$sort": {"increase_pct": -1}},
+                {"$limit": 5}
+            ],
+            "repeat_offenders": [
+                {"$match": INCREASED},
+                {"$group": {
+                    "_id": "$item_id",
+                    "item_brand": {"$first": "$item_brand"},
+                    "item_name": {"$first": "$item_name"},
+                    "count": {"$sum": 1}
+                }},
+                {"$sort": {"count": -1}},
+                {"$limit": 5}
+            ],
+            "top_brands": [
+                {"$match": INCREASED},
+                {"$group": {
+                    "_id": "$item_brand",
+                    "count": {"$sum": 1}
+                }},
+                {"$sort": {"count": -1}},
+                {"$limit": 5}
+            ],
+            "monthly": [
+                {"$group": {
+                    "_id": {"$month": "$date"},
+                    "count": {"$sum": 1}
+                }},
+                {"$sort": {"_id": 1}}
+            ],
+            "averages": [
+                {"$match": {**INCREASED, "price_before": {"$ne": 0}}},
+                {"$project": {
+                    "increase_abs": {"$subtract": ["$price_after", "$price_before"]},
+                    "increase_pct": INCREASE_PCT
+                }},
+                {"$group": {
+                    "_id": None,
+                    "avg_increase_abs": {"$avg": "$increase_abs"},
+                    "avg_increase_pct": {"$avg": "$increase_pct"}
+                }}
+            ]
+        }}
+    ]
+
+
+def build_report(facets):
+    """Turn the $facet output into the values the Wrapped template renders."""
+    month_map = {item['_id']: item['count'] for item in facets['monthly']}
+    month_labels = []
+    month_counts = []
+    max_month_count = 0
+    busiest_month_index = 0
+
+    for i in range(1, 13):
+        count = month_map.get(i, 0)
+        month_labels.append(calendar.month_name[i])
+        month_counts.append(count)
+
+        if count > max_month_count:
+            max_month_count = count
+            busiest_month_index = i
+
+    averages = facets['averages']
+    return {
+        'total_increases': facets['total_increases'][0]['count'] if facets['total_increases'] else 0,
+        'top_pct_increases': facets['top_pct_increases'],
+        'repeat_offenders': facets['repeat_offenders'],
+        'top_brands': facets['top_brands'],
+        'month_labels': month_labels,
+        'month_counts': month_counts,
+        'busiest_month_name': calendar.month_name[busiest_month_index] if busiest_month_index > 0 else "N/A",
+        'avg_increase_abs': averages[0]['avg_increase_abs'] if averages else 0,
+        'avg_increase_pct': averages[0]['avg_increase_pct'] if averages else 0
+    }
+
+
+def year_fingerprint(snapshot, year):
+    """
+    Row count, newest _id and a checksum of a year's updates in the feed
+    snapshot, or None when the year has no data. A report is stale once this
+    changes. The checksum covers every column the report reads, so documents
+    edited in place (and picked up by the daily rebuild) change it too.
+    """
+    start_date, end_date = year_range(year)
+    rows = snapshot.between(start_date.timestamp(), end_date.timestamp())
+    if not rows:
+        return None
+    checksum = hashlib.sha256()
+    for column in (snapshot.timestamps, snapshot.prices_before, snapshot.prices_after, snapshot.item_ids, snapshot.flags):
+        checksum.update(column[rows.start:rows.stop])
+    for column in (snapshot.item_brands, snapshot.item_names):
+        checksum.update(column.heap[column.offsets[rows.start]:column.offsets[rows.stop]])
+    return [len(rows), snapshot.ids[rows[-1]], checksum.hexdigest()[:32]]
+
+
+class WrappedReports:
+    """
+    Wrapped reports materialized into a collection keyed by year.
+    A report is only recomputed from coles_updates when the year's
+    fingerprint no longer matches the stored one, and reports are also kept
+    in memory so repeat views don't touch Mongo at all.
+    """
+
+    def __init__(self, get_collection, get_reports_collection, logger):
+        self.get_collection = get_collection
+        self.get_reports_collection = get_reports_collection
+        self.logger = logger
+        self.reports = {}
+        self.lock = threading.Lock()
+
+    def get(self, year, fingerprint):
+        cached = self.reports.get(year)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        with self.lock:
+            cached = self.reports.get(year)
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1]
+
+            stored = self.get_reports_collection().find_one({"_id": year})
+            if stored is not None and stored.get('fingerprint') == fingerprint:
+                report = stored['report']
+            else:
+                facets = next(self.get_collection().aggregate(wrapped_pipeline(year)))
+                report = build_report(facets)
+                self.logger.info(f"Computed Wrapped {year} report for {fingerprint[0]} updates")
+                try:
+                    self.get_reports_collection().replace_one(
+                        {"_id": year},
+                        {"fingerprint": fingerprint, "computed_at": dt.now(utc_tz), "report": report},
+                        upsert=True
+                    )
+                except Exception as e:
+                    self.logger.warning(f"Failed to store Wrapped {year} report: {e}")
+
+            self.reports[year] = (fingerprint, report)
+            return report